@@ -10,4 +10,4 @@ from backend.api_service import app
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=False)
+    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=False, loop="uvloop", http="httptools")
@@ -1,218 +1,337 @@
+import array
+import asyncio
+import logging
+import mimetypes
 import os
 import shutil
+import signal
+import stat
+import struct
 import threading
 import time
-from typing import Literal, Optional, Tuple
+from enum import IntEnum
+from types import FrameType
+from typing import AsyncIterator, Dict, Literal, Optional, Set, Tuple
 
-from fastapi import FastAPI, HTTPException, Request
+import orjson
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel
-
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from pydantic import BaseModel, ConfigDict
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse
+from starlette.types import Receive, Scope, Send
+
+from .config_parse import env_flag, env_float, env_int, env_str, parse_float_values, parse_levels
 from .db_store import PersistenceStore
 from .gpio_control import GPIOConfig, GPIOController
 
 try:
-    import serial
+    import serial_asyncio
+except ImportError:
+    serial_asyncio = None
+
+try:
+    import fcntl
+    import termios
 except ImportError:
-    serial = None
+    fcntl = None
+
+try:
+    # Only worth using when crcmod's C extension is built; its pure-Python path is no faster.
+    import crcmod._crcfunext
+    import crcmod.predefined
+except ImportError:
+    crcmod = None
+
+class Tank(IntEnum):
+    SOAK = 0
+    FRESH = 1
+    HEAT = 2
+
+
+TANK_NAMES = ("soak", "fresh", "heat")
 
 DEFAULT_LEVELS = [72, 58, 46]
 DEFAULT_TEMPS = [32.5, 22.0, 45.0]
 DEFAULT_PHS = [6.8, 7.2, 6.5]
 
-PH_METER_ENABLED = os.getenv("PH_METER_ENABLED", "1").lower() in {"1", "true", "yes", "on"}
-PH_METER_PORT = os.getenv("PH_METER_PORT", "/dev/ttyUSB0")
-PH_METER_ADDR = int(os.getenv("PH_METER_ADDR", "1"))
-PH_METER_BAUD = int(os.getenv("PH_METER_BAUD", "9600"))
-PH_METER_TIMEOUT = float(os.getenv("PH_METER_TIMEOUT", "0.8"))
-PH_POLL_INTERVAL = float(os.getenv("PH_POLL_INTERVAL", "2.0"))
-PH_STALE_SEC = float(os.getenv("PH_STALE_SEC", "10"))
+PH_METER_ENABLED = env_flag("PH_METER_ENABLED", "1")
+PH_METER_PORT = env_str("PH_METER_PORT", "/dev/ttyUSB0")
+PH_METER_ADDR = env_int("PH_METER_ADDR", "1")
+PH_METER_BAUD = env_int("PH_METER_BAUD", "9600")
+PH_METER_TIMEOUT = env_float("PH_METER_TIMEOUT", "0.8")
+PH_POLL_INTERVAL = env_float("PH_POLL_INTERVAL", "2.0")
+PH_STALE_SEC = env_float("PH_STALE_SEC", "10")
 
-PERSIST_SAMPLE_SEC = max(1.0, float(os.getenv("PERSIST_SAMPLE_SEC", "5")))
-PERSIST_RETENTION_DAYS = max(1, int(os.getenv("PERSIST_RETENTION_DAYS", "30")))
-DB_PATH = os.getenv("DATA_DB_PATH", os.path.join("data", "runtime.db"))
-DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+PERSIST_SAMPLE_SEC = max(1.0, env_float("PERSIST_SAMPLE_SEC", "5"))
+PERSIST_BATCH_SIZE = max(1, env_int("PERSIST_BATCH_SIZE", "6"))
+PERSIST_RETENTION_DAYS = max(1, env_int("PERSIST_RETENTION_DAYS", "30"))
+PERSIST_ERROR_LOG_SEC = 60.0
+PERSIST_SUBPROCESS = env_flag("PERSIST_SUBPROCESS", "0")
+DB_PATH = env_str("DATA_DB_PATH", os.path.join("data", "runtime.db"))
+DB_BUSY_TIMEOUT_MS = env_int("DB_BUSY_TIMEOUT_MS", "5000")
 
+STATUS_CACHE_SEC = max(0.0, env_float("STATUS_CACHE_SEC", "0.5"))
+SYSTEM_STATUS_CACHE_SEC = max(0.0, env_float("SYSTEM_STATUS_CACHE_SEC", "1"))
+STATUS_STREAM_REFRESH_SEC = max(1.0, env_float("STATUS_STREAM_REFRESH_SEC", "5"))
+JINJA_CACHE_DIR = env_str("JINJA_CACHE_DIR", "")
 
-def clamp_level(value: int) -> int:
-    return max(0, min(100, value))
+persist_logger = logging.getLogger("pump_control.persist")
 
+HOSTNAME = os.uname().nodename
+PING_BYTES = orjson.dumps({"ok": True})
+RENDERED_INDEX_MAX = 4
+# state_version restarts at 0 in every process; this keeps a new deploy from matching old ETags.
+INDEX_ETAG_NONCE = f"{time.time_ns():x}"
 
-def clamp(value: float, min_value: float, max_value: float) -> float:
-    return max(min_value, min(max_value, value))
+PRECOMPRESSED_VARIANTS = (("br", ".br"), ("gzip", ".gz"))
 
 
-def lerp(a: float, b: float, t: float) -> float:
-    return a + (b - a) * t
+def clamp(value: float, min_value: float, max_value: float) -> float:
+    return max(min_value, min(max_value, value))
 
 
-def lerp_color(color_a: Tuple[int, int, int], color_b: Tuple[int, int, int], t: float) -> Tuple[int, int, int]:
-    return (
-        int(lerp(color_a[0], color_b[0], t)),
-        int(lerp(color_a[1], color_b[1], t)),
-        int(lerp(color_a[2], color_b[2], t)),
-    )
+COLOR_ACIDIC = (210, 74, 74)
+COLOR_NEUTRAL = (88, 168, 140)
+COLOR_ALKALINE = (76, 120, 208)
+COLOR_WARM = (226, 124, 54)
+COLOR_COOL = (70, 130, 210)
 
 
-def ph_to_color(ph: float) -> Tuple[int, int, int]:
+def blend_ph_temp(ph: float, temp_c: float) -> Tuple[int, int, int]:
     ph = clamp(ph, 0.0, 14.0)
-    acidic = (210, 74, 74)
-    neutral = (88, 168, 140)
-    alkaline = (76, 120, 208)
     if ph <= 7.0:
-        return lerp_color(acidic, neutral, ph / 7.0)
-    return lerp_color(neutral, alkaline, (ph - 7.0) / 7.0)
+        low, high, t = COLOR_ACIDIC, COLOR_NEUTRAL, ph / 7.0
+    else:
+        low, high, t = COLOR_NEUTRAL, COLOR_ALKALINE, (ph - 7.0) / 7.0
+    delta = clamp((temp_c - 25.0) / 20.0, -1.0, 1.0)
+    target = COLOR_WARM if delta >= 0 else COLOR_COOL
+    k = abs(delta) * 0.6
+    r = int(low[0] + (high[0] - low[0]) * t)
+    g = int(low[1] + (high[1] - low[1]) * t)
+    b = int(low[2] + (high[2] - low[2]) * t)
+    return (
+        int(r + (target[0] - r) * k),
+        int(g + (target[1] - g) * k),
+        int(b + (target[2] - b) * k),
+    )
 
 
-def temp_adjust(color: Tuple[int, int, int], temp_c: float) -> Tuple[int, int, int]:
-    warm = (226, 124, 54)
-    cool = (70, 130, 210)
-    delta = clamp((temp_c - 25.0) / 20.0, -1.0, 1.0)
-    if delta >= 0:
-        return lerp_color(color, warm, delta * 0.6)
-    return lerp_color(color, cool, -delta * 0.6)
+# The temperature blend saturates outside 5..45 C, so a 0.1 pH x 1 C grid covers every distinct color.
+COLOR_LUT_PH_STEPS = 141
+COLOR_LUT_TEMP_MIN = 5
+COLOR_LUT_TEMP_MAX = 45
 
 
-def color_for_ph_temp(ph: float, temp_c: float) -> Tuple[int, int, int]:
-    return temp_adjust(ph_to_color(ph), temp_c)
+def build_color_lut() -> list[list[Tuple[int, int, int]]]:
+    lut = []
+    for ph_step in range(COLOR_LUT_PH_STEPS):
+        ph = ph_step / 10.0
+        lut.append([blend_ph_temp(ph, float(temp)) for temp in range(COLOR_LUT_TEMP_MIN, COLOR_LUT_TEMP_MAX + 1)])
+    return lut
 
 
-def parse_levels(value: str, count: int, defaults: list[int]) -> list[int]:
-    levels = []
-    for part in value.split(","):
-        part = part.strip()
-        if not part:
-            continue
-        try:
-            levels.append(clamp_level(int(float(part))))
-        except ValueError:
-            continue
-    while len(levels) < count:
-        levels.append(defaults[len(levels)])
-    return levels[:count]
+COLOR_LUT = build_color_lut()
 
 
-def parse_float_values(value: str, count: int, defaults: list[float]) -> list[float]:
-    values = []
-    for part in value.split(","):
-        part = part.strip()
-        if not part:
-            continue
-        try:
-            values.append(float(part))
-        except ValueError:
-            continue
-    while len(values) < count:
-        values.append(defaults[len(values)])
-    return values[:count]
+def color_for_ph_temp(ph: float, temp_c: float) -> Tuple[int, int, int]:
+    ph_index = int(round(clamp(ph, 0.0, 14.0) * 10))
+    temp_index = int(round(clamp(temp_c, COLOR_LUT_TEMP_MIN, COLOR_LUT_TEMP_MAX))) - COLOR_LUT_TEMP_MIN
+    return COLOR_LUT[ph_index][temp_index]
 
 
-def crc16_modbus(data: bytes) -> int:
-    crc = 0xFFFF
-    for byte in data:
-        crc ^= byte
+def build_crc16_table() -> Tuple[int, ...]:
+    table = []
+    for value in range(256):
+        crc = value
         for _ in range(8):
             if crc & 1:
                 crc = (crc >> 1) ^ 0xA001
             else:
                 crc >>= 1
-    return crc & 0xFFFF
+        table.append(crc)
+    return tuple(table)
+
+
+CRC16_TABLE = build_crc16_table()
+
+
+def crc16_modbus_table(data: bytes) -> int:
+    crc = 0xFFFF
+    for byte in data:
+        crc = (crc >> 8) ^ CRC16_TABLE[(crc ^ byte) & 0xFF]
+    return crc
+
+
+crc16_modbus = crcmod.predefined.mkCrcFun("modbus") if crcmod else crc16_modbus_table
+
+
+# Modbus registers are big-endian; the trailing CRC is little-endian.
+MODBUS_READ_REQUEST = struct.Struct(">BBHH")
+MODBUS_READ_RESPONSE = struct.Struct(">BBBHH")
+MODBUS_CRC = struct.Struct("<H")
 
 
 def build_modbus_request(addr: int, start: int = 0, count: int = 2) -> bytes:
-    payload = bytes([addr, 0x03, (start >> 8) & 0xFF, start & 0xFF, (count >> 8) & 0xFF, count & 0xFF])
-    crc = crc16_modbus(payload)
-    return payload + bytes([crc & 0xFF, (crc >> 8) & 0xFF])
+    payload = MODBUS_READ_REQUEST.pack(addr, 0x03, start & 0xFFFF, count & 0xFFFF)
+    return payload + MODBUS_CRC.pack(crc16_modbus(payload))
 
 
 def parse_modbus_response(resp: bytes, addr: int) -> Optional[Tuple[float, float]]:
     if len(resp) != 9:
         return None
-    if resp[0] != addr or resp[1] != 0x03 or resp[2] != 0x04:
+    resp_addr, function, byte_count, ph_raw, temp_raw = MODBUS_READ_RESPONSE.unpack_from(resp)
+    if resp_addr != addr or function != 0x03 or byte_count != 0x04:
         return None
-    crc_expected = crc16_modbus(resp[:-2])
-    crc_actual = resp[-2] | (resp[-1] << 8)
-    if crc_expected != crc_actual:
+    if crc16_modbus(resp[:7]) != MODBUS_CRC.unpack_from(resp, 7)[0]:
         return None
-    ph_raw = (resp[3] << 8) | resp[4]
-    temp_raw = (resp[5] << 8) | resp[6]
     return ph_raw / 100.0, temp_raw / 10.0
 
 
-gpio = GPIOController(GPIOConfig())
-store = PersistenceStore(DB_PATH, retention_days=PERSIST_RETENTION_DAYS, busy_timeout_ms=DB_BUSY_TIMEOUT_MS)
+# Built in on_startup, not at import: the PERSIST_SUBPROCESS writer re-imports the launching module,
+# and a second controller would re-drive (or fail to claim) the output pins.
+gpio: GPIOController
+store = PersistenceStore(
+    DB_PATH,
+    retention_days=PERSIST_RETENTION_DAYS,
+    busy_timeout_ms=DB_BUSY_TIMEOUT_MS,
+    use_subprocess=PERSIST_SUBPROCESS,
+)
+
+# Tank state is kept as one list per field, indexed by Tank.
+levels_env = env_str("TANK_LEVELS", "")
+tank_levels = parse_levels(levels_env, 3, DEFAULT_LEVELS) if levels_env else DEFAULT_LEVELS[:]
 
-levels_env = os.getenv("TANK_LEVELS", "")
-tank_levels_list = parse_levels(levels_env, 3, DEFAULT_LEVELS) if levels_env else DEFAULT_LEVELS[:]
-tank_levels = {"soak": tank_levels_list[0], "fresh": tank_levels_list[1], "heat": tank_levels_list[2]}
+temps_env = env_str("TANK_TEMPS", "")
+tank_temps = parse_float_values(temps_env, 3, DEFAULT_TEMPS) if temps_env else DEFAULT_TEMPS[:]
 
-temps_env = os.getenv("TANK_TEMPS", "")
-tank_temps_list = parse_float_values(temps_env, 3, DEFAULT_TEMPS) if temps_env else DEFAULT_TEMPS[:]
-tank_temps = {"soak": tank_temps_list[0], "fresh": tank_temps_list[1], "heat": tank_temps_list[2]}
+ph_env = env_str("TANK_PHS", "")
+tank_phs = parse_float_values(ph_env, 3, DEFAULT_PHS) if ph_env else DEFAULT_PHS[:]
 
-ph_env = os.getenv("TANK_PHS", "")
-tank_phs_list = parse_float_values(ph_env, 3, DEFAULT_PHS) if ph_env else DEFAULT_PHS[:]
-tank_phs = {"soak": tank_phs_list[0], "fresh": tank_phs_list[1], "heat": tank_phs_list[2]}
+# Fresh and heat readings only come from configuration, so their colors are fixed.
+FRESH_COLOR = color_for_ph_temp(tank_phs[Tank.FRESH], tank_temps[Tank.FRESH])
+HEAT_COLOR = color_for_ph_temp(tank_phs[Tank.HEAT], tank_temps[Tank.HEAT])
 
-soak_lock = threading.Lock()
-soak_ph_live: Optional[float] = None
-soak_temp_live: Optional[float] = None
-soak_last_good = 0.0
+# (ph, temp, last_good_ts); rebound as a whole so readers never see a torn update.
+soak_state: Tuple[Optional[float], Optional[float], float] = (None, None, 0.0)
+ph_reader_task: Optional["asyncio.Task[None]"] = None
 
 cpu_lock = threading.Lock()
 cpu_last_total: Optional[int] = None
 cpu_last_idle: Optional[int] = None
 
+proc_fds: Dict[str, int] = {}
+# read_proc_file runs on the loop and in to_thread workers; the lock keeps two first reads from both opening.
+proc_fds_lock = threading.Lock()
+system_status_cache: Optional[dict] = None
+system_status_ts = 0.0
+
+status_cache_bytes: Optional[bytes] = None
+status_cache_ts = 0.0
+state_version = 0
+status_subscribers: Set[asyncio.Queue] = set()
+status_streams_closed = False
+rendered_index: Dict[str, bytes] = {}
+
+
+ASYNC_LOW_LATENCY = 1 << 13
+
+
+def enable_low_latency(fd: int) -> None:
+    # USB-serial adapters batch reads on a ~16 ms timer unless the tty is in low-latency mode.
+    if fcntl is None or not hasattr(termios, "TIOCGSERIAL"):
+        return
+    serial_info = array.array("i", [0] * 32)
+    try:
+        fcntl.ioctl(fd, termios.TIOCGSERIAL, serial_info)
+        serial_info[4] |= ASYNC_LOW_LATENCY
+        fcntl.ioctl(fd, termios.TIOCSSERIAL, serial_info)
+    except OSError:
+        pass
+
+
+async def discard_serial_input(reader: asyncio.StreamReader) -> None:
+    # Drop a late or partial frame so the next response starts on a frame boundary.
+    while True:
+        try:
+            chunk = await asyncio.wait_for(reader.read(64), 0.05)
+        except asyncio.TimeoutError:
+            return
+        if not chunk:
+            return
+
 
-def ph_reader_loop() -> None:
-    if not serial or not PH_METER_ENABLED:
+async def ph_reader_loop() -> None:
+    if not serial_asyncio or not PH_METER_ENABLED:
         return
 
-    global soak_ph_live, soak_temp_live, soak_last_good
+    global soak_state
+    request = build_modbus_request(PH_METER_ADDR, 0, 2)
     while True:
+        writer = None
         try:
-            with serial.Serial(PH_METER_PORT, PH_METER_BAUD, timeout=PH_METER_TIMEOUT) as ser:
-                while True:
-                    request = build_modbus_request(PH_METER_ADDR, 0, 2)
-                    try:
-                        ser.reset_input_buffer()
-                    except Exception:
-                        pass
-                    ser.write(request)
-                    ser.flush()
-                    response = ser.read(9)
-                    parsed = parse_modbus_response(response, PH_METER_ADDR)
-                    if parsed:
-                        ph_value, temp_value = parsed
-                        with soak_lock:
-                            soak_ph_live = round(ph_value, 2)
-                            soak_temp_live = round(temp_value, 1)
-                            soak_last_good = time.time()
-                    time.sleep(PH_POLL_INTERVAL)
+            reader, writer = await serial_asyncio.open_serial_connection(url=PH_METER_PORT, baudrate=PH_METER_BAUD)
+            enable_low_latency(writer.transport.serial.fileno())
+            while True:
+                writer.write(request)
+                await writer.drain()
+                try:
+                    response = await asyncio.wait_for(reader.readexactly(9), PH_METER_TIMEOUT)
+                except asyncio.TimeoutError:
+                    response = b""
+                parsed = parse_modbus_response(response, PH_METER_ADDR)
+                if parsed:
+                    ph_value = round(parsed[0], 2)
+                    temp_value = round(parsed[1], 1)
+                    prev_ph, prev_temp, _ = soak_state
+                    changed = ph_value != prev_ph or temp_value != prev_temp
+                    soak_state = (ph_value, temp_value, time.time())
+                    if changed:
+                        # New reading: drop the cached status and push it to stream clients.
+                        mark_state_changed()
+                else:
+                    await discard_serial_input(reader)
+                await asyncio.sleep(PH_POLL_INTERVAL)
+        except asyncio.CancelledError:
+            raise
         except Exception:
-            time.sleep(max(1.0, PH_POLL_INTERVAL))
+            await asyncio.sleep(max(1.0, PH_POLL_INTERVAL))
+        finally:
+            if writer is not None:
+                writer.close()
 
 
 def get_soak_reading() -> Tuple[Optional[float], Optional[float]]:
-    with soak_lock:
-        ph_value = soak_ph_live
-        temp_value = soak_temp_live
-        last_good = soak_last_good
+    ph_value, temp_value, last_good = soak_state
     if last_good and (time.time() - last_good) <= PH_STALE_SEC:
         return temp_value, ph_value
     return None, None
 
 
+def read_proc_file(path: str, size: int = 512) -> bytes:
+    # procfs/sysfs regenerate content on every read at offset 0, so the descriptor can stay open.
+    fd = proc_fds.get(path)
+    if fd is None:
+        with proc_fds_lock:
+            fd = proc_fds.get(path)
+            if fd is None:
+                fd = os.open(path, os.O_RDONLY)
+                proc_fds[path] = fd
+    return os.pread(fd, size, 0)
+
+
 def get_cpu_percent() -> Optional[float]:
     global cpu_last_total, cpu_last_idle
     try:
-        with open("/proc/stat", "r", encoding="utf-8") as f:
-            first_line = f.readline().strip()
-        parts = first_line.split()
-        if len(parts) < 5 or parts[0] != "cpu":
+        raw = read_proc_file("/proc/stat")
+        parts = raw[: raw.index(b"\n")].split()
+        if len(parts) < 5 or parts[0] != b"cpu":
             return None
         values = [int(v) for v in parts[1:]]
         idle = values[3] + (values[4] if len(values) > 4 else 0)
@@ -240,14 +359,13 @@ def get_memory_percent() -> Optional[float]:
     try:
         total_kb = 0
         available_kb = 0
-        with open("/proc/meminfo", "r", encoding="utf-8") as f:
-            for line in f:
-                if line.startswith("MemTotal:"):
-                    total_kb = int(line.split()[1])
-                elif line.startswith("MemAvailable:"):
-                    available_kb = int(line.split()[1])
-                if total_kb and available_kb:
-                    break
+        for line in read_proc_file("/proc/meminfo").splitlines():
+            if line.startswith(b"MemTotal:"):
+                total_kb = int(line.split()[1])
+            elif line.startswith(b"MemAvailable:"):
+                available_kb = int(line.split()[1])
+            if total_kb and available_kb:
+                break
         if total_kb <= 0:
             return None
         used_ratio = (total_kb - available_kb) / total_kb
@@ -270,29 +388,37 @@ def get_disk_percent(path: str = "/") -> Optional[float]:
 def get_cpu_temp() -> Optional[float]:
     thermal_path = "/sys/class/thermal/thermal_zone0/temp"
     try:
-        with open(thermal_path, "r", encoding="utf-8") as f:
-            raw = f.read().strip()
-        return round(int(raw) / 1000.0, 1)
+        return round(int(read_proc_file(thermal_path, 32)) / 1000.0, 1)
     except Exception:
         return None
 
 
 def get_uptime_seconds() -> Optional[int]:
     try:
-        with open("/proc/uptime", "r", encoding="utf-8") as f:
-            raw = f.read().strip().split()[0]
-        return int(float(raw))
+        return int(float(read_proc_file("/proc/uptime", 64).split()[0]))
     except Exception:
         return None
 
 
 def get_system_status() -> dict:
+    # Host metrics move on a seconds scale; reuse the last read instead of re-reading procfs per poll.
+    global system_status_cache, system_status_ts
+    now = time.monotonic()
+    cached = system_status_cache
+    if cached is not None and (now - system_status_ts) < SYSTEM_STATUS_CACHE_SEC:
+        return cached
+    system_status_cache = read_system_status()
+    system_status_ts = now
+    return system_status_cache
+
+
+def read_system_status() -> dict:
     try:
         load1, load5, load15 = os.getloadavg()
     except Exception:
         load1, load5, load15 = (0.0, 0.0, 0.0)
     return {
-        "host": os.uname().nodename,
+        "host": HOSTNAME,
         "gpio_backend": gpio.backend,
         "cpu_percent": get_cpu_percent(),
         "memory_percent": get_memory_percent(),
@@ -305,16 +431,32 @@ def get_system_status() -> dict:
     }
 
 
+def tank_view(values: list) -> dict:
+    return dict(zip(TANK_NAMES, values))
+
+
 def build_tank_colors(soak_temp: Optional[float], soak_ph: Optional[float]) -> dict:
-    soak_temp_color = soak_temp if soak_temp is not None else tank_temps["soak"]
-    soak_ph_color = soak_ph if soak_ph is not None else tank_phs["soak"]
+    soak_temp_color = soak_temp if soak_temp is not None else tank_temps[Tank.SOAK]
+    soak_ph_color = soak_ph if soak_ph is not None else tank_phs[Tank.SOAK]
     return {
         "soak": color_for_ph_temp(soak_ph_color, soak_temp_color),
-        "fresh": color_for_ph_temp(tank_phs["fresh"], tank_temps["fresh"]),
-        "heat": color_for_ph_temp(tank_phs["heat"], tank_temps["heat"]),
+        "fresh": FRESH_COLOR,
+        "heat": HEAT_COLOR,
     }
 
 
+def build_static_tank_status(tank: Tank, color: Tuple[int, int, int]) -> dict:
+    return {"temp": tank_temps[tank], "ph": tank_phs[tank], "level": tank_levels[tank], "color": color}
+
+
+# Fresh and heat entries never change at runtime, so every snapshot shares these dicts read-only.
+FRESH_TANK_STATUS = build_static_tank_status(Tank.FRESH, FRESH_COLOR)
+HEAT_TANK_STATUS = build_static_tank_status(Tank.HEAT, HEAT_COLOR)
+# Pre-encoded copies spliced into the status JSON; the dicts above stay for persistence.
+FRESH_TANK_JSON = orjson.Fragment(orjson.dumps(FRESH_TANK_STATUS))
+HEAT_TANK_JSON = orjson.Fragment(orjson.dumps(HEAT_TANK_STATUS))
+
+
 def build_status_snapshot() -> dict:
     soak_temp, soak_ph = get_soak_reading()
     tank_colors = build_tank_colors(soak_temp, soak_ph)
@@ -324,45 +466,202 @@ def build_status_snapshot() -> dict:
         "soak": {
             "temp": soak_temp,
             "ph": soak_ph,
-            "level": tank_levels["soak"],
-            "color": list(tank_colors["soak"]),
-        },
-        "fresh": {
-            "temp": tank_temps["fresh"],
-            "ph": tank_phs["fresh"],
-            "level": tank_levels["fresh"],
-            "color": list(tank_colors["fresh"]),
-        },
-        "heat": {
-            "temp": tank_temps["heat"],
-            "ph": tank_phs["heat"],
-            "level": tank_levels["heat"],
-            "color": list(tank_colors["heat"]),
+            "level": tank_levels[Tank.SOAK],
+            "color": tank_colors["soak"],
         },
+        "fresh": FRESH_TANK_STATUS,
+        "heat": HEAT_TANK_STATUS,
     }
     return base
 
 
+def invalidate_status_cache() -> None:
+    global status_cache_bytes, state_version
+    status_cache_bytes = None
+    state_version += 1
+
+
+def publish_status() -> None:
+    if not status_subscribers:
+        return
+    payload = get_status_bytes()
+    for queue in status_subscribers:
+        try:
+            queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            # A slow client keeps its backlog; it will get the next change or refresh.
+            continue
+
+
+def mark_state_changed() -> None:
+    invalidate_status_cache()
+    publish_status()
+
+
+def close_status_streams() -> None:
+    # uvicorn waits for open responses before running shutdown hooks, so end every stream first.
+    global status_streams_closed
+    status_streams_closed = True
+    for queue in status_subscribers:
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+
+def install_shutdown_signal_hooks(loop: asyncio.AbstractEventLoop) -> None:
+    # Chain onto the server's SIGINT/SIGTERM handlers (uvicorn installs them with signal.signal).
+    # Handlers can only be set from the main thread; embedded runners (e.g. TestClient) are skipped.
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        previous = signal.getsignal(sig)
+        if not callable(previous):
+            continue
+
+        def handle(signum: int, frame: Optional[FrameType], previous=previous) -> None:
+            loop.call_soon_threadsafe(close_status_streams)
+            previous(signum, frame)
+
+        signal.signal(sig, handle)
+
+
+async def status_updates() -> AsyncIterator[bytes]:
+    if status_streams_closed:
+        return
+    queue: asyncio.Queue = asyncio.Queue(maxsize=8)
+    status_subscribers.add(queue)
+    try:
+        payload = get_status_bytes()
+        while True:
+            yield payload
+            try:
+                payload = await asyncio.wait_for(queue.get(), STATUS_STREAM_REFRESH_SEC)
+            except asyncio.TimeoutError:
+                # Sensor and system readings drift without control changes, so refresh periodically.
+                payload = get_status_bytes()
+            if payload is None:
+                return
+    finally:
+        status_subscribers.discard(queue)
+
+
+async def status_event_stream() -> AsyncIterator[bytes]:
+    async for payload in status_updates():
+        yield b"data: " + payload + b"\n\n"
+
+
+def index_etag(soak_temp: Optional[float], soak_ph: Optional[float]) -> str:
+    # Weak: GZipMiddleware may send the same page gzip-encoded or not under this one tag.
+    return f'W/"{INDEX_ETAG_NONCE}-{state_version}-{soak_temp}-{soak_ph}"'
+
+
+def get_history_bytes(hours: float, limit: int, downsample: int) -> bytes:
+    return orjson.dumps(store.get_history(hours=hours, limit=limit, downsample=downsample))
+
+
+def get_status_bytes() -> bytes:
+    global status_cache_bytes, status_cache_ts
+    now = time.monotonic()
+    cached = status_cache_bytes
+    if cached is not None and (now - status_cache_ts) < STATUS_CACHE_SEC:
+        return cached
+    snapshot = build_status_snapshot()
+    tank = snapshot["tank"]
+    tank["fresh"] = FRESH_TANK_JSON
+    tank["heat"] = HEAT_TANK_JSON
+    payload = orjson.dumps(snapshot)
+    status_cache_bytes = payload
+    status_cache_ts = now
+    return payload
+
+
+def accepted_encodings(header: str) -> Set[str]:
+    # Accept-Encoding tokens with a non-zero q value ("gzip;q=0" means "never gzip").
+    accepted = set()
+    for token in header.split(","):
+        name, _, params = token.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        name = name.strip().lower()
+        if name and quality > 0:
+            accepted.add(name)
+    return accepted
+
+
+class CachedStaticFiles(StaticFiles):
+    def file_response(
+        self,
+        full_path: str,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        path = os.fspath(full_path)
+        accept_encoding = accepted_encodings(request_headers.get("accept-encoding", ""))
+        response: Response = FileResponse(path, status_code=status_code, stat_result=stat_result)
+        for encoding, suffix in PRECOMPRESSED_VARIANTS:
+            if encoding not in accept_encoding:
+                continue
+            try:
+                variant_stat = os.stat(path + suffix)
+            except OSError:
+                continue
+            # Ignore variants older than the source so an edited file is never shadowed.
+            if variant_stat.st_mtime < stat_result.st_mtime:
+                continue
+            response = FileResponse(
+                path + suffix,
+                status_code=status_code,
+                stat_result=variant_stat,
+                media_type=mimetypes.guess_type(path)[0] or "text/plain",
+                # GZipMiddleware passes encoded responses through untouched, so Vary is ours to set here;
+                # on the plain path the middleware adds it when it compresses.
+                headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"},
+            )
+            break
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
 def persistence_loop() -> None:
     last_cleanup_ts = 0.0
+    last_error_ts = 0.0
+    suppressed_errors = 0
     while True:
         now_ts = time.time()
         try:
             snapshot = build_status_snapshot()
-            store.persist_snapshot(snapshot, now_ts)
+            if store.queue_snapshot(snapshot, now_ts) >= PERSIST_BATCH_SIZE:
+                store.flush_snapshots()
             store.update_runtime_daily(snapshot, now_ts)
             if now_ts - last_cleanup_ts >= 3600:
                 store.prune_old_data(now_ts)
+                # Two PRAGMA reads unless pruning has freed enough of the file to be worth a VACUUM.
+                store.compact_if_needed()
                 last_cleanup_ts = now_ts
-        except Exception as exc:
-            print(f"[persist] error: {exc}")
+        except Exception:
+            # A persistent failure (disk full, locked DB) repeats every sample; log it at most once per interval.
+            if now_ts - last_error_ts >= PERSIST_ERROR_LOG_SEC:
+                persist_logger.exception("persistence failed (%d similar errors suppressed)", suppressed_errors)
+                last_error_ts = now_ts
+                suppressed_errors = 0
+            else:
+                suppressed_errors += 1
         time.sleep(PERSIST_SAMPLE_SEC)
 
 
-app = FastAPI(title="Pump Relay Control")
+app = FastAPI(title="Pump Relay Control", default_response_class=ORJSONResponse)
 
 cors_allow_origins = [
-    origin.strip() for origin in os.getenv("CORS_ALLOW_ORIGINS", "*").split(",") if origin.strip()
+    origin.strip() for origin in env_str("CORS_ALLOW_ORIGINS", "*").split(",") if origin.strip()
 ]
 if not cors_allow_origins:
     cors_allow_origins = ["*"]
@@ -374,103 +673,201 @@ app.add_middleware(
     allow_headers=["*"],
     allow_credentials=False,
 )
+# Event streams have to reach the client one event at a time; gzip would hold them in its buffer.
+UNCOMPRESSED_PATHS = frozenset({"/api/status/stream"})
+
+
+class StreamAwareGZipMiddleware(GZipMiddleware):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"] in UNCOMPRESSED_PATHS:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+# Level 5 keeps most of the ratio on history/index payloads at a fraction of level 9's CPU on the Pi;
+# status-sized bodies (<1 KiB) go out uncompressed.
+app.add_middleware(StreamAwareGZipMiddleware, minimum_size=1024, compresslevel=5)
+
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
+
+
+def build_bytecode_cache() -> FileSystemBytecodeCache:
+    # Cached bytecode is loaded with marshal and executed, so the directory must be private to this user.
+    if not JINJA_CACHE_DIR:
+        # Jinja's default is a per-user directory it creates 0700 and refuses if owned by someone else.
+        return FileSystemBytecodeCache()
+    os.makedirs(JINJA_CACHE_DIR, mode=0o700, exist_ok=True)
+    st = os.lstat(JINJA_CACHE_DIR)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or stat.S_IMODE(st.st_mode) & 0o077:
+        raise RuntimeError(f"JINJA_CACHE_DIR={JINJA_CACHE_DIR} must be a directory owned by this user with mode 0700.")
+    return FileSystemBytecodeCache(directory=JINJA_CACHE_DIR)
+
+
+def build_template_env() -> Environment:
+    # Templates only change on deploy (which restarts the service), so skip per-render stat checks.
+    env = Environment(
+        loader=FileSystemLoader("templates"),
+        autoescape=True,
+        auto_reload=False,
+        cache_size=400,
+        bytecode_cache=build_bytecode_cache(),
+    )
+    env.get_template("index.html")
+    return env
+
+
+templates = Jinja2Templates(env=build_template_env())
+
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
+def render_index(etag: str, soak_temp: Optional[float], soak_ph: Optional[float]) -> bytes:
+    cached = rendered_index.get(etag)
+    if cached is not None:
+        return cached
+    html = templates.get_template("index.html").render(
+        {
+            "pumps": gpio.relay_snapshot(),
+            "tank_levels": tank_view(tank_levels),
+            "tank_temps": tank_view(tank_temps),
+            "tank_phs": tank_view(tank_phs),
+            "soak_temp": soak_temp,
+            "soak_ph": soak_ph,
+            "tank_colors": build_tank_colors(soak_temp, soak_ph),
+            "auto_switches": gpio.auto_switches,
+            "heater": {"configured": True, "on": gpio.heater.is_active},
+        }
+    )
+    body = html.encode("utf-8")
+    if len(rendered_index) >= RENDERED_INDEX_MAX:
+        rendered_index.pop(next(iter(rendered_index)))
+    rendered_index[etag] = body
+    return body
 
 
 @app.on_event("startup")
-def on_startup() -> None:
+async def on_startup() -> None:
+    global gpio, ph_reader_task
+    gpio = GPIOController(GPIOConfig())
+    install_shutdown_signal_hooks(asyncio.get_running_loop())
     store.init_schema()
     restored = store.restore_lift_estimate(gpio.config.lift_max_mm)
     if restored is not None:
         gpio.set_lift_estimated_mm(restored)
 
-    if PH_METER_ENABLED and serial:
-        thread = threading.Thread(target=ph_reader_loop, daemon=True)
-        thread.start()
+    if PH_METER_ENABLED and serial_asyncio:
+        ph_reader_task = asyncio.create_task(ph_reader_loop())
 
     persist_thread = threading.Thread(target=persistence_loop, daemon=True)
     persist_thread.start()
 
 
+@app.on_event("shutdown")
+def on_shutdown() -> None:
+    # Write out samples still waiting for a full batch, the lift position it stopped at, today's runtime
+    # counters, and queued control events.
+    store.flush_snapshots()
+    store.save_lift_estimate(round(gpio.get_lift_estimate()[0], 1))
+    store.flush_runtime_daily()
+    store.flush()
+    store.close()
+
+
 class RelayCommand(BaseModel):
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
     index: int
     on: bool
 
 
 class AutoSwitchCommand(BaseModel):
-    which: str
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
+    which: Literal["fresh", "heat"]
     on: bool
 
 
 class HeaterCommand(BaseModel):
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
     on: bool
 
 
 class LiftCommand(BaseModel):
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
     state: Literal["up", "down", "stop"]
 
 
 @app.get("/", response_class=HTMLResponse)
-def index(request: Request) -> HTMLResponse:
+async def index(request: Request) -> Response:
     soak_temp, soak_ph = get_soak_reading()
-    tank_colors = build_tank_colors(soak_temp, soak_ph)
-    return templates.TemplateResponse(
-        "index.html",
-        {
-            "request": request,
-            "pumps": gpio.relay_snapshot(),
-            "tank_levels": tank_levels,
-            "tank_temps": tank_temps,
-            "tank_phs": tank_phs,
-            "soak_temp": soak_temp,
-            "soak_ph": soak_ph,
-            "tank_colors": tank_colors,
-            "auto_switches": gpio.auto_switches,
-            "heater": {"configured": True, "on": gpio.heater.is_active},
-        },
-    )
+    etag = index_etag(soak_temp, soak_ph)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(content=render_index(etag, soak_temp, soak_ph), headers=headers)
 
 
 @app.get("/api/status")
-def api_status() -> dict:
-    return build_status_snapshot()
+async def api_status() -> Response:
+    return Response(content=get_status_bytes(), media_type="application/json")
+
+
+@app.get("/api/status/stream")
+async def api_status_stream() -> StreamingResponse:
+    return StreamingResponse(
+        status_event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.websocket("/ws/status")
+async def ws_status(websocket: WebSocket) -> None:
+    await websocket.accept()
+    updates = status_updates()
+    try:
+        async for payload in updates:
+            await websocket.send_text(payload.decode())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await updates.aclose()
 
 
 @app.post("/api/relay")
-def api_relay(cmd: RelayCommand) -> dict:
-    prev = gpio.relay_snapshot()
+async def api_relay(cmd: RelayCommand) -> dict:
     try:
+        prev_on = gpio.relay_device(cmd.index).is_active
         next_on = gpio.set_relay(cmd.index, cmd.on)
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
-    prev_on = next((item["on"] for item in prev if item["index"] == cmd.index), False)
+    mark_state_changed()
     store.record_control_event("api", f"relay:{cmd.index}", prev_on, next_on, True)
     return {"on": next_on}
 
 
 @app.post("/api/auto")
-def api_auto(cmd: AutoSwitchCommand) -> dict:
-    if cmd.which not in gpio.auto_switches:
-        raise HTTPException(status_code=400, detail="Invalid auto switch.")
+async def api_auto(cmd: AutoSwitchCommand) -> dict:
     prev = gpio.auto_switches[cmd.which]
     try:
         auto_state = gpio.set_auto(cmd.which, cmd.on)
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
+    mark_state_changed()
     store.record_control_event("api", f"auto:{cmd.which}", prev, auto_state[cmd.which], True)
     return {"auto": auto_state}
 
 
 @app.post("/api/lift")
-def api_lift(cmd: LiftCommand) -> dict:
+async def api_lift(cmd: LiftCommand) -> dict:
     prev_state = gpio.lift_state
     try:
         state = gpio.set_lift(cmd.state)
     except ValueError as exc:
         store.record_control_event("api", "lift", prev_state, prev_state, False, str(exc))
         raise HTTPException(status_code=400, detail=str(exc)) from exc
+    mark_state_changed()
     mm, percent = gpio.get_lift_estimate()
     store.record_control_event("api", "lift", prev_state, state, True)
     return {
@@ -484,28 +881,31 @@ def api_lift(cmd: LiftCommand) -> dict:
 
 
 @app.post("/api/heater")
-def api_heater(cmd: HeaterCommand) -> dict:
+async def api_heater(cmd: HeaterCommand) -> dict:
     prev = gpio.heater.is_active
     next_on = gpio.set_heater(cmd.on)
+    mark_state_changed()
     store.record_control_event("api", "heater", prev, next_on, True)
     return {"configured": True, "on": next_on}
 
 
 @app.get("/api/ping")
-def api_ping() -> dict:
-    return {"ok": True}
+async def api_ping() -> Response:
+    return Response(content=PING_BYTES, media_type="application/json")
 
 
 @app.get("/api/history")
-def api_history(hours: float = 2.0, limit: int = 1500) -> dict:
-    return store.get_history(hours=hours, limit=limit)
+async def api_history(hours: float = 2.0, limit: int = 1500, downsample: int = 0) -> Response:
+    # Encode in the worker thread too; a full window is the largest payload the API returns.
+    payload = await asyncio.to_thread(get_history_bytes, hours, limit, downsample)
+    return Response(content=payload, media_type="application/json")
 
 
 @app.get("/api/events")
-def api_events(limit: int = 120) -> dict:
-    return store.get_events(limit=limit)
+async def api_events(limit: int = 120) -> dict:
+    return await asyncio.to_thread(store.get_events, limit=limit)
 
 
 @app.get("/api/runtime")
-def api_runtime(days: int = 7) -> dict:
-    return store.get_runtime(days=days)
+async def api_runtime(days: int = 7) -> dict:
+    return await asyncio.to_thread(store.get_runtime, days=days)
@@ -0,0 +1,59 @@
+import os
+import re
+from typing import Dict, List
+
+_TOKEN_RE = re.compile(r"[^,\s]+")
+
+# Configuration is read once at import; the service is restarted to pick up changes.
+_ENV: Dict[str, str] = dict(os.environ)
+TRUTHY: frozenset[str] = frozenset(("1", "true", "yes", "on"))
+
+
+def env_str(name: str, default: str) -> str:
+    return _ENV.get(name, default)
+
+
+def env_flag(name: str, default: str) -> bool:
+    return _ENV.get(name, default).lower() in TRUTHY
+
+
+def env_int(name: str, default: str) -> int:
+    return int(_ENV.get(name, default))
+
+
+def env_float(name: str, default: str) -> float:
+    return float(_ENV.get(name, default))
+
+
+def clamp_level(value: int) -> int:
+    return max(0, min(100, value))
+
+
+def parse_floats(value: str) -> List[float]:
+    values = []
+    for match in _TOKEN_RE.finditer(value):
+        try:
+            values.append(float(match.group()))
+        except ValueError:
+            continue
+    return values
+
+
+def parse_ints(value: str) -> List[int]:
+    values = []
+    for number in parse_floats(value):
+        try:
+            values.append(int(number))
+        except (ValueError, OverflowError):
+            continue
+    return values
+
+
+def parse_levels(value: str, count: int, defaults: List[int]) -> List[int]:
+    levels = [clamp_level(v) for v in parse_ints(value)[:count]]
+    return levels + defaults[len(levels):count]
+
+
+def parse_float_values(value: str, count: int, defaults: List[float]) -> List[float]:
+    values = parse_floats(value)[:count]
+    return values + defaults[len(values):count]
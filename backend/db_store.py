@@ -1,20 +1,361 @@
+import logging
+import multiprocessing
 import os
+import pathlib
+import queue
+import signal
 import sqlite3
 import threading
 import time
-from typing import Any, Dict, List, Optional
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+logger = logging.getLogger("pump_control.persist")
+
+# The background writer commits up to this many queued statements, or whatever arrives in the window, at once.
+WRITE_BATCH_MAX = 64
+WRITE_BATCH_WINDOW_SEC = 0.1
+# How often an idle writer process checks that the API process that started it is still running.
+WRITER_PARENT_POLL_SEC = 1.0
+# runtime_daily counters are held in memory and upserted at most this often.
+RUNTIME_FLUSH_SEC = 60.0
+# compact_if_needed rebuilds the file only once at least this share of its pages are free.
+COMPACT_FREE_RATIO = 0.25
+# Series whose shape drives history downsampling for the process and system tables.
+HISTORY_SHAPE_COLUMNS = ("soak_temp", "cpu_percent")
+
+WriteItem = Union[Tuple[str, Tuple[Any, ...]], threading.Event]
+# (sql, parameters, executemany?); a list of these is committed as one transaction.
+Statement = Tuple[str, Any, bool]
+# Writer-process inbox item asking it to run compaction on its own connection.
+_COMPACT_REQUEST = "compact"
+
+# Statements are module constants so sqlite3's statement cache reuses one prepared statement.
+_SQL_INSERT_PROCESS = """
+INSERT INTO process_samples(
+    ts, soak_temp, soak_ph, soak_level, fresh_level, heat_level,
+    pump1, pump2, pump3, valve_fresh, valve_heat, lift_state, lift_estimated_mm, heater_on
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+_SQL_INSERT_SYSTEM = """
+INSERT INTO system_samples(
+    ts, host, gpio_backend, cpu_percent, memory_percent, disk_percent,
+    cpu_temp, uptime_sec, load1, load5, load15
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+_SQL_INSERT_EVENT = """
+INSERT INTO control_events(ts, source, target, prev_value, next_value, ok, message)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+_SQL_UPSERT_KV = """
+INSERT INTO kv_state(key, value, updated_ts)
+VALUES (?, ?, ?)
+ON CONFLICT(key) DO UPDATE SET
+    value=excluded.value,
+    updated_ts=excluded.updated_ts
+"""
+_SQL_UPSERT_RUNTIME = """
+INSERT INTO runtime_daily(
+    day, pump1_runtime_sec, pump2_runtime_sec, pump3_runtime_sec, heater_runtime_sec,
+    pump1_starts, pump2_starts, pump3_starts, heater_starts,
+    valve_fresh_switches, valve_heat_switches, updated_ts
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(day) DO UPDATE SET
+    pump1_runtime_sec = runtime_daily.pump1_runtime_sec + excluded.pump1_runtime_sec,
+    pump2_runtime_sec = runtime_daily.pump2_runtime_sec + excluded.pump2_runtime_sec,
+    pump3_runtime_sec = runtime_daily.pump3_runtime_sec + excluded.pump3_runtime_sec,
+    heater_runtime_sec = runtime_daily.heater_runtime_sec + excluded.heater_runtime_sec,
+    pump1_starts = runtime_daily.pump1_starts + excluded.pump1_starts,
+    pump2_starts = runtime_daily.pump2_starts + excluded.pump2_starts,
+    pump3_starts = runtime_daily.pump3_starts + excluded.pump3_starts,
+    heater_starts = runtime_daily.heater_starts + excluded.heater_starts,
+    valve_fresh_switches = runtime_daily.valve_fresh_switches + excluded.valve_fresh_switches,
+    valve_heat_switches = runtime_daily.valve_heat_switches + excluded.valve_heat_switches,
+    updated_ts = excluded.updated_ts
+"""
+# runtime_daily counter columns, in _SQL_UPSERT_RUNTIME parameter order.
+_RUNTIME_COUNTERS = (
+    "pump1_runtime_sec", "pump2_runtime_sec", "pump3_runtime_sec", "heater_runtime_sec",
+    "pump1_starts", "pump2_starts", "pump3_starts", "heater_starts",
+    "valve_fresh_switches", "valve_heat_switches",
+)
+_SQL_SELECT_KV = "SELECT value FROM kv_state WHERE key=?"
+_SQL_SELECT_EVENTS = """
+SELECT ts, source, target, prev_value, next_value, ok, message
+FROM control_events
+ORDER BY ts DESC
+LIMIT ?
+"""
+_RUNTIME_SELECT = """
+SELECT
+    day,
+    pump1_runtime_sec, pump2_runtime_sec, pump3_runtime_sec, heater_runtime_sec,
+    pump1_starts, pump2_starts, pump3_starts, heater_starts,
+    valve_fresh_switches, valve_heat_switches, updated_ts
+FROM runtime_daily
+"""
+_SQL_SELECT_RUNTIME = _RUNTIME_SELECT + "ORDER BY day DESC LIMIT ?"
+_SQL_SELECT_RUNTIME_DAY = _RUNTIME_SELECT + "WHERE day=?"
+# History is returned column-oriented: {"ts": [...], "soak_temp": [...], ...}.
+_PROCESS_COLUMNS = (
+    "ts", "soak_temp", "soak_ph", "soak_level", "fresh_level", "heat_level",
+    "pump1", "pump2", "pump3", "valve_fresh", "valve_heat", "lift_state", "lift_estimated_mm", "heater_on",
+)
+_SYSTEM_COLUMNS = (
+    "ts", "host", "gpio_backend", "cpu_percent", "memory_percent", "disk_percent",
+    "cpu_temp", "uptime_sec", "load1", "load5", "load15",
+)
+# Sensor columns are stored as fixed-point integers (value * scale) so SQLite packs them as small varints.
+_PROCESS_SCALES = {
+    "soak_temp": 100,
+    "soak_ph": 100,
+    "soak_level": 10,
+    "fresh_level": 10,
+    "heat_level": 10,
+    "lift_estimated_mm": 10,
+}
+_PROCESS_SELECT_EXPRS = ", ".join(
+    f"{name} / {_PROCESS_SCALES[name]}.0 AS {name}" if name in _PROCESS_SCALES else name for name in _PROCESS_COLUMNS
+)
+_SQL_SELECT_PROCESS = f"SELECT {_PROCESS_SELECT_EXPRS} FROM process_samples WHERE ts >= ? ORDER BY ts ASC LIMIT ?"
+_SQL_SELECT_SYSTEM = f"SELECT {', '.join(_SYSTEM_COLUMNS)} FROM system_samples WHERE ts >= ? ORDER BY ts ASC LIMIT ?"
+# Rescales sensor values written before fixed-point storage (schema user_version 0).
+_SQL_MIGRATE_FIXED_POINT = "UPDATE process_samples SET " + ", ".join(
+    f"{name} = CAST(round({name} * {scale}) AS INTEGER)" for name, scale in _PROCESS_SCALES.items()
+)
+# Applied to writer and reader connections: keep sorts/temp b-trees in RAM and read pages via mmap.
+_CONNECTION_PRAGMAS = (
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA mmap_size=268435456",
+)
+# (statement, True when the cutoff is the day string rather than epoch ms)
+_PRUNE_SQL = (
+    ("DELETE FROM process_samples WHERE ts < ?", False),
+    ("DELETE FROM system_samples WHERE ts < ?", False),
+    ("DELETE FROM control_events WHERE ts < ?", False),
+    ("DELETE FROM runtime_daily WHERE day < ?", True),
+)
+
+_SQL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS process_samples (
+    id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    soak_temp INTEGER,
+    soak_ph INTEGER,
+    soak_level INTEGER,
+    fresh_level INTEGER,
+    heat_level INTEGER,
+    pump1 INTEGER NOT NULL,
+    pump2 INTEGER NOT NULL,
+    pump3 INTEGER NOT NULL,
+    valve_fresh INTEGER NOT NULL,
+    valve_heat INTEGER NOT NULL,
+    lift_state TEXT NOT NULL,
+    lift_estimated_mm INTEGER,
+    heater_on INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_process_samples_ts ON process_samples(ts);
+
+CREATE TABLE IF NOT EXISTS system_samples (
+    id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    host TEXT,
+    gpio_backend TEXT,
+    cpu_percent REAL,
+    memory_percent REAL,
+    disk_percent REAL,
+    cpu_temp REAL,
+    uptime_sec INTEGER,
+    load1 REAL,
+    load5 REAL,
+    load15 REAL
+);
+CREATE INDEX IF NOT EXISTS idx_system_samples_ts ON system_samples(ts);
+
+CREATE TABLE IF NOT EXISTS control_events (
+    id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    prev_value TEXT,
+    next_value TEXT,
+    ok INTEGER NOT NULL,
+    message TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_control_events_ts ON control_events(ts);
+
+CREATE TABLE IF NOT EXISTS runtime_daily (
+    day TEXT PRIMARY KEY,
+    pump1_runtime_sec INTEGER NOT NULL DEFAULT 0,
+    pump2_runtime_sec INTEGER NOT NULL DEFAULT 0,
+    pump3_runtime_sec INTEGER NOT NULL DEFAULT 0,
+    heater_runtime_sec INTEGER NOT NULL DEFAULT 0,
+    pump1_starts INTEGER NOT NULL DEFAULT 0,
+    pump2_starts INTEGER NOT NULL DEFAULT 0,
+    pump3_starts INTEGER NOT NULL DEFAULT 0,
+    heater_starts INTEGER NOT NULL DEFAULT 0,
+    valve_fresh_switches INTEGER NOT NULL DEFAULT 0,
+    valve_heat_switches INTEGER NOT NULL DEFAULT 0,
+    updated_ts INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS kv_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    updated_ts INTEGER NOT NULL
+);
+"""
+
+
+def _run_statements(conn: sqlite3.Connection, statements: List[Statement]) -> None:
+    for sql, params, many in statements:
+        if many:
+            conn.executemany(sql, params)
+        else:
+            conn.execute(sql, params)
+
+
+def _writer_process_main(db_path: str, busy_timeout_ms: int, inbox: Any, acks: Any) -> None:
+    # PERSIST_SUBPROCESS writer. Inbox items are statement lists, int flush tokens (echoed on acks
+    # once everything before them is committed), _COMPACT_REQUEST, or None to exit.
+    # Service stop signals the whole process group; keep draining until the parent sends None,
+    # or until the parent disappears without sending it (checked while the inbox is idle).
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    parent_pid = os.getppid()
+    conn = sqlite3.connect(db_path)
+    conn.execute(f"PRAGMA busy_timeout={busy_timeout_ms}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    for pragma in _CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    while True:
+        try:
+            batch = [inbox.get(timeout=WRITER_PARENT_POLL_SEC)]
+        except queue.Empty:
+            if os.getppid() != parent_pid:
+                batch = [None]
+            else:
+                continue
+        deadline = time.monotonic() + WRITE_BATCH_WINDOW_SEC
+        while len(batch) < WRITE_BATCH_MAX and batch[-1] is not None:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(inbox.get(timeout=timeout))
+            except queue.Empty:
+                break
+        statements = [statement for item in batch if isinstance(item, list) for statement in item]
+        if statements:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                _run_statements(conn, statements)
+                conn.commit()
+            except Exception:
+                if conn.in_transaction:
+                    conn.rollback()
+                logger.exception("dropped %d queued writes", len(statements))
+        for item in batch:
+            if item is None:
+                conn.close()
+                return
+            if item == _COMPACT_REQUEST:
+                try:
+                    _compact_if_needed(conn)
+                except Exception:
+                    logger.exception("database compaction failed")
+            elif isinstance(item, int):
+                acks.put(item)
+
+
+def _compact_if_needed(conn: sqlite3.Connection) -> bool:
+    # Pruning leaves free pages behind; VACUUM rewrites the file in place and the TRUNCATE checkpoint
+    # shrinks the WAL it went through. In place so open reader connections stay valid.
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    free_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if not page_count or free_count / page_count < COMPACT_FREE_RATIO:
+        return False
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    logger.info("compacted database: %d of %d pages were free", free_count, page_count)
+    return True
+
+
+def _fixed(value: Optional[float], scale: int) -> Optional[int]:
+    return None if value is None else int(round(value * scale))
+
+
+def _lttb_indices(xs: List[Any], ys: List[Any], threshold: int) -> List[int]:
+    # Largest-Triangle-Three-Buckets: keep the first and last points, then from each bucket the point
+    # forming the largest triangle with the previous pick and the next bucket's average.
+    n = len(xs)
+    if threshold < 3 or threshold >= n:
+        return list(range(n))
+    ys = [0.0 if y is None else float(y) for y in ys]
+    every = (n - 2) / (threshold - 2)
+    indices = [0]
+    picked = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        next_end = min(int((bucket + 2) * every) + 1, n)
+        count = next_end - end
+        avg_x = sum(xs[end:next_end]) / count
+        avg_y = sum(ys[end:next_end]) / count
+        ax, ay = xs[picked], ys[picked]
+        best_area = -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                picked = j
+        indices.append(picked)
+    indices.append(n - 1)
+    return indices
+
+
+def _downsample(columns: Dict[str, List[Any]], shape_column: str, points: int) -> Dict[str, List[Any]]:
+    # Every column keeps the same rows so the arrays stay aligned with "ts".
+    if len(columns["ts"]) <= points:
+        return columns
+    indices = _lttb_indices(columns["ts"], columns[shape_column], points)
+    return {name: [values[i] for i in indices] for name, values in columns.items()}
 
 
 class PersistenceStore:
-    def __init__(self, db_path: str, retention_days: int = 30, busy_timeout_ms: int = 5000) -> None:
+    def __init__(
+        self,
+        db_path: str,
+        retention_days: int = 30,
+        busy_timeout_ms: int = 5000,
+        use_subprocess: bool = False,
+    ) -> None:
         self.db_path = db_path
         self.retention_days = max(1, int(retention_days))
         self.busy_timeout_ms = int(busy_timeout_ms)
+        self.use_subprocess = use_subprocess
 
         self._db_lock = threading.Lock()
         self._db_conn: Optional[sqlite3.Connection] = None
+        self._reader_local = threading.local()
+        self._write_queue: "queue.SimpleQueue[WriteItem]" = queue.SimpleQueue()
+        self._writer_lock = threading.Lock()
+        self._writer_thread: Optional[threading.Thread] = None
+        self._writer_process: Optional[multiprocessing.process.BaseProcess] = None
+        self._process_inbox: Any = None
+        self._process_acks: Any = None
+        self._flush_token = 0
         self._runtime_prev_state: Optional[Dict[str, bool]] = None
         self._runtime_last_ts = time.time()
+        self._runtime_flushed_ts = self._runtime_last_ts
+        self._runtime_pending: Dict[str, int] = {}
+        self._runtime_pending_day: Optional[str] = None
+
+        self._pending_lock = threading.Lock()
+        self._pending_process: List[Tuple[Any, ...]] = []
+        self._pending_system: List[Tuple[Any, ...]] = []
+        self._lift_written: Optional[str] = None
 
     def _connect_locked(self) -> sqlite3.Connection:
         if self._db_conn is not None:
@@ -25,121 +366,185 @@ class PersistenceStore:
             os.makedirs(db_dir, exist_ok=True)
 
         conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
         conn.execute("PRAGMA journal_mode=WAL")
         conn.execute("PRAGMA synchronous=NORMAL")
         conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        conn.execute("PRAGMA wal_autocheckpoint=1000")
+        for pragma in _CONNECTION_PRAGMAS:
+            conn.execute(pragma)
         self._db_conn = conn
         return conn
 
+    def _reader(self) -> sqlite3.Connection:
+        # WAL lets readers run alongside the writer, so each thread gets its own read-only connection.
+        conn = getattr(self._reader_local, "conn", None)
+        if conn is not None:
+            return conn
+        if self._db_conn is None:
+            # The writer creates the file and switches it to WAL before any read-only open.
+            with self._db_lock:
+                self._connect_locked()
+        uri = pathlib.Path(self.db_path).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True)
+        # Named rows are only needed on the read side; the writer connection never fetches rows by name.
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        conn.execute("PRAGMA query_only=1")
+        for pragma in _CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        self._reader_local.conn = conn
+        return conn
+
     def init_schema(self) -> None:
-        schema = """
-        CREATE TABLE IF NOT EXISTS process_samples (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ts INTEGER NOT NULL,
-            soak_temp REAL,
-            soak_ph REAL,
-            soak_level REAL,
-            fresh_level REAL,
-            heat_level REAL,
-            pump1 INTEGER NOT NULL,
-            pump2 INTEGER NOT NULL,
-            pump3 INTEGER NOT NULL,
-            valve_fresh INTEGER NOT NULL,
-            valve_heat INTEGER NOT NULL,
-            lift_state TEXT NOT NULL,
-            lift_estimated_mm REAL,
-            heater_on INTEGER NOT NULL
-        );
-        CREATE INDEX IF NOT EXISTS idx_process_samples_ts ON process_samples(ts);
-
-        CREATE TABLE IF NOT EXISTS system_samples (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ts INTEGER NOT NULL,
-            host TEXT,
-            gpio_backend TEXT,
-            cpu_percent REAL,
-            memory_percent REAL,
-            disk_percent REAL,
-            cpu_temp REAL,
-            uptime_sec INTEGER,
-            load1 REAL,
-            load5 REAL,
-            load15 REAL
-        );
-        CREATE INDEX IF NOT EXISTS idx_system_samples_ts ON system_samples(ts);
-
-        CREATE TABLE IF NOT EXISTS control_events (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ts INTEGER NOT NULL,
-            source TEXT NOT NULL,
-            target TEXT NOT NULL,
-            prev_value TEXT,
-            next_value TEXT,
-            ok INTEGER NOT NULL,
-            message TEXT
-        );
-        CREATE INDEX IF NOT EXISTS idx_control_events_ts ON control_events(ts);
-
-        CREATE TABLE IF NOT EXISTS runtime_daily (
-            day TEXT PRIMARY KEY,
-            pump1_runtime_sec INTEGER NOT NULL DEFAULT 0,
-            pump2_runtime_sec INTEGER NOT NULL DEFAULT 0,
-            pump3_runtime_sec INTEGER NOT NULL DEFAULT 0,
-            heater_runtime_sec INTEGER NOT NULL DEFAULT 0,
-            pump1_starts INTEGER NOT NULL DEFAULT 0,
-            pump2_starts INTEGER NOT NULL DEFAULT 0,
-            pump3_starts INTEGER NOT NULL DEFAULT 0,
-            heater_starts INTEGER NOT NULL DEFAULT 0,
-            valve_fresh_switches INTEGER NOT NULL DEFAULT 0,
-            valve_heat_switches INTEGER NOT NULL DEFAULT 0,
-            updated_ts INTEGER NOT NULL
-        );
-
-        CREATE TABLE IF NOT EXISTS kv_state (
-            key TEXT PRIMARY KEY,
-            value TEXT NOT NULL,
-            updated_ts INTEGER NOT NULL
-        );
-        """
         with self._db_lock:
             conn = self._connect_locked()
-            conn.executescript(schema)
+            conn.executescript(_SQL_SCHEMA)
+            if conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+                conn.execute(_SQL_MIGRATE_FIXED_POINT)
+                conn.execute("PRAGMA user_version=1")
             conn.commit()
 
-    def _execute(self, sql: str, params: tuple[Any, ...] = ()) -> None:
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        # BEGIN IMMEDIATE takes the write lock up front, so the block commits once or rolls back whole.
         with self._db_lock:
             conn = self._connect_locked()
-            conn.execute(sql, params)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
             conn.commit()
 
+    def _write(self, statements: List[Statement]) -> None:
+        # Commits the statements as one transaction here, or hands them to the writer process.
+        if self.use_subprocess:
+            self._writer_inbox().put(statements)
+            return
+        with self._transaction() as conn:
+            _run_statements(conn, statements)
+
+    def _writer_inbox(self) -> Any:
+        process = self._writer_process
+        if process is None or not process.is_alive():
+            with self._writer_lock:
+                process = self._writer_process
+                if process is not None and not process.is_alive():
+                    # Whatever it had queued but not committed is gone; start a fresh writer for new work.
+                    logger.error("writer process exited with code %s; restarting it", process.exitcode)
+                    self._writer_process = None
+                if self._writer_process is None:
+                    self._start_writer_process()
+        return self._process_inbox
+
+    def _start_writer_process(self) -> None:
+        # spawn, not fork: the parent already runs the event loop and other threads. The child re-imports
+        # the parent's __main__, so importing the app must stay free of hardware setup.
+        ctx = multiprocessing.get_context("spawn")
+        self._process_inbox = ctx.Queue()
+        self._process_acks = ctx.Queue()
+        process = ctx.Process(
+            target=_writer_process_main,
+            args=(self.db_path, self.busy_timeout_ms, self._process_inbox, self._process_acks),
+            name="sqlite-writer",
+            daemon=True,
+        )
+        process.start()
+        self._writer_process = process
+
+    def _enqueue_write(self, item: WriteItem) -> None:
+        if self.use_subprocess:
+            sql, params = item
+            self._writer_inbox().put([(sql, params, False)])
+            return
+        if self._writer_thread is None:
+            with self._writer_lock:
+                if self._writer_thread is None:
+                    self._writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+                    self._writer_thread.start()
+        self._write_queue.put(item)
+
+    def _writer_loop(self) -> None:
+        while True:
+            batch = [self._write_queue.get()]
+            deadline = time.monotonic() + WRITE_BATCH_WINDOW_SEC
+            while len(batch) < WRITE_BATCH_MAX:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._write_queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            statements = [item for item in batch if not isinstance(item, threading.Event)]
+            try:
+                if statements:
+                    with self._transaction() as conn:
+                        for sql, params in statements:
+                            conn.execute(sql, params)
+            except Exception:
+                logger.exception("dropped %d queued writes", len(statements))
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def flush(self, timeout: float = 5.0) -> None:
+        # Block until everything queued so far has been committed (or dropped on error).
+        if self._writer_process is not None:
+            self._flush_process(timeout)
+            return
+        if self._writer_thread is None:
+            return
+        done = threading.Event()
+        self._write_queue.put(done)
+        done.wait(timeout)
+
+    def _flush_process(self, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+        with self._writer_lock:
+            self._flush_token += 1
+            token = self._flush_token
+            self._process_inbox.put(token)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._writer_process.is_alive():
+                    return
+                try:
+                    if self._process_acks.get(timeout=min(remaining, 0.5)) >= token:
+                        return
+                except queue.Empty:
+                    continue
+
+    def close(self, timeout: float = 5.0) -> None:
+        # Stops the writer process, if one was started, after it commits what it has queued.
+        process = self._writer_process
+        if process is None:
+            return
+        self._process_inbox.put(None)
+        process.join(timeout)
+        self._writer_process = None
+        self._process_inbox = self._process_acks = None
+
     def _query_all(self, sql: str, params: tuple[Any, ...] = ()) -> List[Dict[str, Any]]:
-        with self._db_lock:
-            conn = self._connect_locked()
-            rows = conn.execute(sql, params).fetchall()
+        rows = self._reader().execute(sql, params).fetchall()
         return [dict(row) for row in rows]
 
+    def _query_columns(self, sql: str, params: tuple[Any, ...], columns: Tuple[str, ...]) -> Dict[str, List[Any]]:
+        # Plain tuples transposed into one list per column: no per-row dict for large history windows.
+        cursor = self._reader().cursor()
+        cursor.row_factory = None
+        rows = cursor.execute(sql, params).fetchall()
+        if not rows:
+            return {name: [] for name in columns}
+        return dict(zip(columns, map(list, zip(*rows))))
+
     def _query_one(self, sql: str, params: tuple[Any, ...] = ()) -> Optional[Dict[str, Any]]:
-        with self._db_lock:
-            conn = self._connect_locked()
-            row = conn.execute(sql, params).fetchone()
+        row = self._reader().execute(sql, params).fetchone()
         return dict(row) if row else None
 
-    def set_kv(self, key: str, value: str) -> None:
-        now_ms = int(time.time() * 1000)
-        self._execute(
-            """
-            INSERT INTO kv_state(key, value, updated_ts)
-            VALUES (?, ?, ?)
-            ON CONFLICT(key) DO UPDATE SET
-                value=excluded.value,
-                updated_ts=excluded.updated_ts
-            """,
-            (key, value, now_ms),
-        )
-
     def get_kv(self, key: str) -> Optional[str]:
-        row = self._query_one("SELECT value FROM kv_state WHERE key=?", (key,))
+        row = self._query_one(_SQL_SELECT_KV, (key,))
         return row["value"] if row else None
 
     def restore_lift_estimate(self, lift_max_mm: float) -> Optional[float]:
@@ -152,6 +557,16 @@ class PersistenceStore:
             return None
         return max(0.0, min(float(lift_max_mm), value))
 
+    def save_lift_estimate(self, estimated_mm: float, now_ts: Optional[float] = None) -> None:
+        # Only changes are written: the lift sits still most of the time and every sample carries its estimate.
+        value = str(estimated_mm)
+        with self._pending_lock:
+            if value == self._lift_written:
+                return
+            self._lift_written = value
+        now_ms = int((time.time() if now_ts is None else now_ts) * 1000)
+        self._enqueue_write((_SQL_UPSERT_KV, ("lift_estimated_mm", value, now_ms)))
+
     def record_control_event(
         self,
         source: str,
@@ -161,93 +576,101 @@ class PersistenceStore:
         ok: bool,
         message: str = "",
     ) -> None:
-        self._execute(
-            """
-            INSERT INTO control_events(ts, source, target, prev_value, next_value, ok, message)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
+        # Queued so control endpoints never wait on SQLite; the writer thread batches the commit.
+        self._enqueue_write(
             (
-                int(time.time() * 1000),
-                source,
-                target,
-                str(prev_value) if prev_value is not None else None,
-                str(next_value) if next_value is not None else None,
-                1 if ok else 0,
-                message,
-            ),
+                _SQL_INSERT_EVENT,
+                (
+                    int(time.time() * 1000),
+                    source,
+                    target,
+                    str(prev_value) if prev_value is not None else None,
+                    str(next_value) if next_value is not None else None,
+                    1 if ok else 0,
+                    message,
+                ),
+            )
         )
 
-    def persist_snapshot(self, snapshot: Dict[str, Any], now_ts: float) -> None:
+    def queue_snapshot(self, snapshot: Dict[str, Any], now_ts: float) -> int:
+        # Rows are built now: snapshots share mutable views that change before the flush.
         now_ms = int(now_ts * 1000)
+        process_row = self._process_row(snapshot, now_ms)
+        system_row = self._system_row(snapshot, now_ms)
+        # The lift estimate is restored on the next start, so it goes out with the sample, not the batch.
+        self.save_lift_estimate(snapshot.get("lift", {}).get("estimated_mm", 0.0), now_ts)
+        with self._pending_lock:
+            self._pending_process.append(process_row)
+            self._pending_system.append(system_row)
+            return len(self._pending_process)
+
+    def flush_snapshots(self) -> None:
+        with self._pending_lock:
+            process_rows, self._pending_process = self._pending_process, []
+            system_rows, self._pending_system = self._pending_system, []
+        if not process_rows:
+            return
+
+        # One transaction per batch, so the whole batch costs a single commit.
+        self._write([(_SQL_INSERT_PROCESS, process_rows, True), (_SQL_INSERT_SYSTEM, system_rows, True)])
+
+    @staticmethod
+    def _process_row(snapshot: Dict[str, Any], now_ms: int) -> Tuple[Any, ...]:
         relays = snapshot.get("relays", [])
         auto = snapshot.get("auto", {})
         lift = snapshot.get("lift", {})
         heater = snapshot.get("heater", {})
         tank = snapshot.get("tank", {})
-        system = snapshot.get("system", {})
-
-        def relay_on(index: int) -> int:
-            for relay in relays:
-                if relay.get("index") == index:
-                    return 1 if relay.get("on") else 0
-            return 0
-
-        self._execute(
-            """
-            INSERT INTO process_samples(
-                ts, soak_temp, soak_ph, soak_level, fresh_level, heat_level,
-                pump1, pump2, pump3, valve_fresh, valve_heat, lift_state, lift_estimated_mm, heater_on
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                now_ms,
-                tank.get("soak", {}).get("temp"),
-                tank.get("soak", {}).get("ph"),
-                tank.get("soak", {}).get("level"),
-                tank.get("fresh", {}).get("level"),
-                tank.get("heat", {}).get("level"),
-                relay_on(0),
-                relay_on(1),
-                relay_on(2),
-                1 if auto.get("fresh") else 0,
-                1 if auto.get("heat") else 0,
-                str(lift.get("state", "stop")),
-                lift.get("estimated_mm"),
-                1 if heater.get("on") else 0,
-            ),
+        relay_map = {r.get("index"): bool(r.get("on")) for r in relays}
+
+        soak = tank.get("soak", {})
+        scales = _PROCESS_SCALES
+
+        return (
+            now_ms,
+            _fixed(soak.get("temp"), scales["soak_temp"]),
+            _fixed(soak.get("ph"), scales["soak_ph"]),
+            _fixed(soak.get("level"), scales["soak_level"]),
+            _fixed(tank.get("fresh", {}).get("level"), scales["fresh_level"]),
+            _fixed(tank.get("heat", {}).get("level"), scales["heat_level"]),
+            int(relay_map.get(0, False)),
+            int(relay_map.get(1, False)),
+            int(relay_map.get(2, False)),
+            1 if auto.get("fresh") else 0,
+            1 if auto.get("heat") else 0,
+            str(lift.get("state", "stop")),
+            _fixed(lift.get("estimated_mm"), scales["lift_estimated_mm"]),
+            1 if heater.get("on") else 0,
         )
-        self._execute(
-            """
-            INSERT INTO system_samples(
-                ts, host, gpio_backend, cpu_percent, memory_percent, disk_percent,
-                cpu_temp, uptime_sec, load1, load5, load15
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                now_ms,
-                system.get("host"),
-                system.get("gpio_backend"),
-                system.get("cpu_percent"),
-                system.get("memory_percent"),
-                system.get("disk_percent"),
-                system.get("cpu_temp"),
-                system.get("uptime_sec"),
-                system.get("load1"),
-                system.get("load5"),
-                system.get("load15"),
-            ),
+
+    @staticmethod
+    def _system_row(snapshot: Dict[str, Any], now_ms: int) -> Tuple[Any, ...]:
+        system = snapshot.get("system", {})
+        return (
+            now_ms,
+            system.get("host"),
+            system.get("gpio_backend"),
+            system.get("cpu_percent"),
+            system.get("memory_percent"),
+            system.get("disk_percent"),
+            system.get("cpu_temp"),
+            system.get("uptime_sec"),
+            system.get("load1"),
+            system.get("load5"),
+            system.get("load15"),
         )
-        self.set_kv("lift_estimated_mm", str(lift.get("estimated_mm", 0.0)))
 
     def update_runtime_daily(self, snapshot: Dict[str, Any], now_ts: float) -> None:
         relays = snapshot.get("relays", [])
         auto = snapshot.get("auto", {})
         heater = snapshot.get("heater", {})
 
+        relay_map = {r.get("index"): bool(r.get("on")) for r in relays}
+
         current = {
-            "pump1": any(r.get("index") == 0 and r.get("on") for r in relays),
-            "pump2": any(r.get("index") == 1 and r.get("on") for r in relays),
-            "pump3": any(r.get("index") == 2 and r.get("on") for r in relays),
+            "pump1": relay_map.get(0, False),
+            "pump2": relay_map.get(1, False),
+            "pump3": relay_map.get(2, False),
             "heater": bool(heater.get("on")),
             "valve_fresh": bool(auto.get("fresh")),
             "valve_heat": bool(auto.get("heat")),
@@ -274,119 +697,81 @@ class PersistenceStore:
             "valve_heat_switches": 1 if self._runtime_prev_state["valve_heat"] != current["valve_heat"] else 0,
         }
 
-        self._execute(
-            """
-            INSERT INTO runtime_daily(
-                day, pump1_runtime_sec, pump2_runtime_sec, pump3_runtime_sec, heater_runtime_sec,
-                pump1_starts, pump2_starts, pump3_starts, heater_starts,
-                valve_fresh_switches, valve_heat_switches, updated_ts
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(day) DO UPDATE SET
-                pump1_runtime_sec = runtime_daily.pump1_runtime_sec + excluded.pump1_runtime_sec,
-                pump2_runtime_sec = runtime_daily.pump2_runtime_sec + excluded.pump2_runtime_sec,
-                pump3_runtime_sec = runtime_daily.pump3_runtime_sec + excluded.pump3_runtime_sec,
-                heater_runtime_sec = runtime_daily.heater_runtime_sec + excluded.heater_runtime_sec,
-                pump1_starts = runtime_daily.pump1_starts + excluded.pump1_starts,
-                pump2_starts = runtime_daily.pump2_starts + excluded.pump2_starts,
-                pump3_starts = runtime_daily.pump3_starts + excluded.pump3_starts,
-                heater_starts = runtime_daily.heater_starts + excluded.heater_starts,
-                valve_fresh_switches = runtime_daily.valve_fresh_switches + excluded.valve_fresh_switches,
-                valve_heat_switches = runtime_daily.valve_heat_switches + excluded.valve_heat_switches,
-                updated_ts = excluded.updated_ts
-            """,
-            (
-                day,
-                runtime_inc["pump1_runtime_sec"],
-                runtime_inc["pump2_runtime_sec"],
-                runtime_inc["pump3_runtime_sec"],
-                runtime_inc["heater_runtime_sec"],
-                runtime_inc["pump1_starts"],
-                runtime_inc["pump2_starts"],
-                runtime_inc["pump3_starts"],
-                runtime_inc["heater_starts"],
-                runtime_inc["valve_fresh_switches"],
-                runtime_inc["valve_heat_switches"],
-                int(now_ts * 1000),
-            ),
-        )
+        # Counters accumulate in memory and reach SQLite once per RUNTIME_FLUSH_SEC or on a day change.
+        if self._runtime_pending_day is not None and self._runtime_pending_day != day:
+            self.flush_runtime_daily(now_ts)
+        with self._pending_lock:
+            self._runtime_pending_day = day
+            pending = self._runtime_pending
+            for name, value in runtime_inc.items():
+                pending[name] = pending.get(name, 0) + value
+        if now_ts - self._runtime_flushed_ts >= RUNTIME_FLUSH_SEC:
+            self.flush_runtime_daily(now_ts)
 
         self._runtime_prev_state = current
 
+    def flush_runtime_daily(self, now_ts: Optional[float] = None) -> None:
+        if now_ts is None:
+            now_ts = time.time()
+        with self._pending_lock:
+            day, self._runtime_pending_day = self._runtime_pending_day, None
+            pending, self._runtime_pending = self._runtime_pending, {}
+            self._runtime_flushed_ts = now_ts
+        if day is None:
+            return
+
+        params = (day, *(pending.get(name, 0) for name in _RUNTIME_COUNTERS), int(now_ts * 1000))
+        self._write([(_SQL_UPSERT_RUNTIME, params, False)])
+
     def prune_old_data(self, now_ts: float) -> None:
         cutoff_ms = int((now_ts - self.retention_days * 86400) * 1000)
         cutoff_day = time.strftime("%Y-%m-%d", time.localtime(now_ts - self.retention_days * 86400))
 
-        self._execute("DELETE FROM process_samples WHERE ts < ?", (cutoff_ms,))
-        self._execute("DELETE FROM system_samples WHERE ts < ?", (cutoff_ms,))
-        self._execute("DELETE FROM control_events WHERE ts < ?", (cutoff_ms,))
-        self._execute("DELETE FROM runtime_daily WHERE day < ?", (cutoff_day,))
+        self._write([(sql, (cutoff_day if by_day else cutoff_ms,), False) for sql, by_day in _PRUNE_SQL])
+
+    def compact_if_needed(self) -> None:
+        # Runs on whichever connection owns writes, so the VACUUM never competes with the writer for the lock.
+        if self.use_subprocess:
+            self._writer_inbox().put(_COMPACT_REQUEST)
+            return
+        with self._db_lock:
+            _compact_if_needed(self._connect_locked())
 
-    def get_history(self, hours: float = 2.0, limit: int = 1500) -> Dict[str, Any]:
+    def get_history(self, hours: float = 2.0, limit: int = 1500, downsample: int = 0) -> Dict[str, Any]:
         bounded_hours = max(0.1, min(168.0, float(hours)))
         bounded_limit = max(50, min(5000, int(limit)))
         cutoff_ms = int((time.time() - bounded_hours * 3600) * 1000)
 
-        process_rows = self._query_all(
-            """
-            SELECT
-                ts, soak_temp, soak_ph, soak_level, fresh_level, heat_level,
-                pump1, pump2, pump3, valve_fresh, valve_heat, lift_state, lift_estimated_mm, heater_on
-            FROM process_samples
-            WHERE ts >= ?
-            ORDER BY ts ASC
-            LIMIT ?
-            """,
-            (cutoff_ms, bounded_limit),
-        )
-        system_rows = self._query_all(
-            """
-            SELECT
-                ts, host, gpio_backend, cpu_percent, memory_percent, disk_percent,
-                cpu_temp, uptime_sec, load1, load5, load15
-            FROM system_samples
-            WHERE ts >= ?
-            ORDER BY ts ASC
-            LIMIT ?
-            """,
-            (cutoff_ms, bounded_limit),
-        )
+        process_columns = self._query_columns(_SQL_SELECT_PROCESS, (cutoff_ms, bounded_limit), _PROCESS_COLUMNS)
+        system_columns = self._query_columns(_SQL_SELECT_SYSTEM, (cutoff_ms, bounded_limit), _SYSTEM_COLUMNS)
+        if downsample > 0:
+            # 0 returns raw rows; otherwise reduce each table to about this many points with LTTB.
+            points = max(10, min(bounded_limit, int(downsample)))
+            process_columns = _downsample(process_columns, HISTORY_SHAPE_COLUMNS[0], points)
+            system_columns = _downsample(system_columns, HISTORY_SHAPE_COLUMNS[1], points)
         return {
             "hours": bounded_hours,
-            "process": process_rows,
-            "system": system_rows,
+            "process": process_columns,
+            "system": system_columns,
         }
 
     def get_events(self, limit: int = 120) -> Dict[str, Any]:
         bounded_limit = max(20, min(1000, int(limit)))
-        rows = self._query_all(
-            """
-            SELECT ts, source, target, prev_value, next_value, ok, message
-            FROM control_events
-            ORDER BY ts DESC
-            LIMIT ?
-            """,
-            (bounded_limit,),
-        )
+        rows = self._query_all(_SQL_SELECT_EVENTS, (bounded_limit,))
         return {"events": rows}
 
     def get_runtime(self, days: int = 7) -> Dict[str, Any]:
         bounded_days = max(1, min(90, int(days)))
-        rows = self._query_all(
-            """
-            SELECT
-                day,
-                pump1_runtime_sec, pump2_runtime_sec, pump3_runtime_sec, heater_runtime_sec,
-                pump1_starts, pump2_starts, pump3_starts, heater_starts,
-                valve_fresh_switches, valve_heat_switches, updated_ts
-            FROM runtime_daily
-            ORDER BY day DESC
-            LIMIT ?
-            """,
-            (bounded_days,),
-        )
         today = time.strftime("%Y-%m-%d")
-        today_row = next((row for row in rows if row["day"] == today), None)
+        conn = self._reader()
+        # Both reads run in one transaction so they see the same WAL snapshot; today's row is a primary-key seek.
+        conn.execute("BEGIN")
+        try:
+            rows = [dict(row) for row in conn.execute(_SQL_SELECT_RUNTIME, (bounded_days,)).fetchall()]
+            today_row = conn.execute(_SQL_SELECT_RUNTIME_DAY, (today,)).fetchone()
+        finally:
+            conn.commit()
         return {
-            "today": today_row,
+            "today": dict(today_row) if today_row else None,
             "days": rows,
         }
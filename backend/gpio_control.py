@@ -1,8 +1,12 @@
-import os
+import functools
 import threading
 import time
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Protocol
+from enum import IntEnum
+from types import ModuleType
+from typing import Callable, Dict, List, Optional, Protocol, Set, Tuple
+
+from .config_parse import env_flag, env_float, env_str
 
 try:
     import Jetson.GPIO as JetsonGPIO
@@ -22,141 +26,136 @@ except ImportError:
 
 class OutputDevice(Protocol):
     pin: int
+    is_active: bool
 
     def on(self) -> None: ...
 
     def off(self) -> None: ...
 
-    @property
-    def is_active(self) -> bool: ...
-
     @property
     def value(self) -> int: ...
 
     def close(self) -> None: ...
 
 
-def env_flag(name: str, default: str) -> bool:
-    return os.getenv(name, default).lower() in {"1", "true", "yes", "on"}
-
-
-class JetsonOutputDevice:
-    def __init__(self, pin: int, pin_mode: str, active_low: bool = False, initial_value: bool = False) -> None:
-        self.pin = pin
-        self.active_low = active_low
-        self._is_active = bool(initial_value)
-        if pin_mode == "BCM":
-            JetsonGPIO.setmode(JetsonGPIO.BCM)
-        else:
-            JetsonGPIO.setmode(JetsonGPIO.BOARD)
-        JetsonGPIO.setwarnings(False)
-        level = JetsonGPIO.HIGH if (initial_value ^ active_low) else JetsonGPIO.LOW
-        JetsonGPIO.setup(pin, JetsonGPIO.OUT, initial=level)
-
-    def on(self) -> None:
-        JetsonGPIO.output(self.pin, JetsonGPIO.LOW if self.active_low else JetsonGPIO.HIGH)
-        self._is_active = True
-
-    def off(self) -> None:
-        JetsonGPIO.output(self.pin, JetsonGPIO.HIGH if self.active_low else JetsonGPIO.LOW)
-        self._is_active = False
+# setmode/setwarnings are process-wide in Jetson.GPIO and RPi.GPIO, so apply them once per module.
+_modes_set: Set[ModuleType] = set()
 
-    @property
-    def is_active(self) -> bool:
-        return self._is_active
 
-    @property
-    def value(self) -> int:
-        return 1 if self._is_active else 0
+def _ensure_mode(gpio_module: ModuleType, pin_mode: str) -> None:
+    if gpio_module in _modes_set:
+        return
+    gpio_module.setmode(gpio_module.BCM if pin_mode == "BCM" else gpio_module.BOARD)
+    gpio_module.setwarnings(False)
+    _modes_set.add(gpio_module)
 
-    def close(self) -> None:
-        JetsonGPIO.cleanup(self.pin)
 
+# Jetson.GPIO mirrors the RPi.GPIO API, so one class drives either module.
+class PinOutputDevice:
+    __slots__ = ("gpio", "pin", "active_low", "is_active", "on_level", "off_level")
 
-class RpiOutputDevice:
-    def __init__(self, pin: int, pin_mode: str, active_low: bool = False, initial_value: bool = False) -> None:
+    def __init__(
+        self,
+        pin: int,
+        gpio_module: ModuleType,
+        pin_mode: str,
+        active_low: bool = False,
+        initial_value: bool = False,
+    ) -> None:
+        self.gpio = gpio_module
         self.pin = pin
         self.active_low = active_low
-        self._is_active = bool(initial_value)
-        if pin_mode == "BCM":
-            RPiGPIO.setmode(RPiGPIO.BCM)
-        else:
-            RPiGPIO.setmode(RPiGPIO.BOARD)
-        RPiGPIO.setwarnings(False)
-        level = RPiGPIO.HIGH if (initial_value ^ active_low) else RPiGPIO.LOW
-        RPiGPIO.setup(pin, RPiGPIO.OUT, initial=level)
+        self.is_active = initial_value
+        self.on_level = gpio_module.LOW if active_low else gpio_module.HIGH
+        self.off_level = gpio_module.HIGH if active_low else gpio_module.LOW
+        _ensure_mode(gpio_module, pin_mode)
+        gpio_module.setup(pin, gpio_module.OUT, initial=self.on_level if initial_value else self.off_level)
 
     def on(self) -> None:
-        RPiGPIO.output(self.pin, RPiGPIO.LOW if self.active_low else RPiGPIO.HIGH)
-        self._is_active = True
+        self.gpio.output(self.pin, self.on_level)
+        self.is_active = True
 
     def off(self) -> None:
-        RPiGPIO.output(self.pin, RPiGPIO.HIGH if self.active_low else RPiGPIO.LOW)
-        self._is_active = False
-
-    @property
-    def is_active(self) -> bool:
-        return self._is_active
+        self.gpio.output(self.pin, self.off_level)
+        self.is_active = False
 
     @property
     def value(self) -> int:
-        return 1 if self._is_active else 0
+        return 1 if self.is_active else 0
 
     def close(self) -> None:
-        RPiGPIO.cleanup(self.pin)
+        self.gpio.cleanup(self.pin)
 
 
 class GpiozeroOutputDevice:
+    __slots__ = ("device", "pin", "is_active")
+
     def __init__(self, pin: int, active_low: bool = False, initial_value: bool = False) -> None:
         self.device = GpiozeroDigitalOutputDevice(pin, active_high=not active_low, initial_value=initial_value)
         self.pin = pin
+        self.is_active = initial_value
 
     def on(self) -> None:
         self.device.on()
+        self.is_active = True
 
     def off(self) -> None:
         self.device.off()
-
-    @property
-    def is_active(self) -> bool:
-        return self.device.is_active
+        self.is_active = False
 
     @property
     def value(self) -> int:
-        return self.device.value
+        return 1 if self.is_active else 0
 
     def close(self) -> None:
         self.device.close()
 
 
 class StubOutputDevice:
+    __slots__ = ("pin", "active_low", "is_active")
+
     def __init__(self, pin: int, active_low: bool = False, initial_value: bool = False) -> None:
         self.pin = pin
         self.active_low = active_low
-        self._is_active = bool(initial_value)
+        self.is_active = initial_value
 
     def on(self) -> None:
-        self._is_active = True
+        self.is_active = True
 
     def off(self) -> None:
-        self._is_active = False
-
-    @property
-    def is_active(self) -> bool:
-        return self._is_active
+        self.is_active = False
 
     @property
     def value(self) -> int:
-        return 1 if self._is_active else 0
+        return 1 if self.is_active else 0
 
     def close(self) -> None:
         return None
 
 
+PIN_GPIO_MODULES = {"jetson": JetsonGPIO, "rpigpio": RPiGPIO}
+DEVICE_CLASSES = {
+    "gpiozero": GpiozeroOutputDevice,
+    "stub": StubOutputDevice,
+}
+
+
+class LiftState(IntEnum):
+    STOP = 0
+    UP = 1
+    DOWN = 2
+
+
+LIFT_STATES = {"stop": LiftState.STOP, "up": LiftState.UP, "down": LiftState.DOWN}
+LIFT_STATE_NAMES = ("stop", "up", "down")
+# Sign applied to lift_speed_mm_s while in each state.
+LIFT_DIRECTIONS = (0.0, 1.0, -1.0)
+
+
 @dataclass
 class GPIOConfig:
-    backend: str = os.getenv("GPIO_BACKEND", "auto").lower()
-    pin_mode: str = os.getenv("PIN_MODE", "BOARD").upper()
+    backend: str = env_str("GPIO_BACKEND", "auto").lower()
+    pin_mode: str = env_str("PIN_MODE", "BOARD").upper()
 
     pin_pump1: int = 4
     pin_pump2: int = 14
@@ -168,43 +167,61 @@ class GPIOConfig:
     pin_lift_down: int = 24
 
     relay_active_low: bool = env_flag("RELAY_ACTIVE_LOW", "0")
-    valve_active_low: bool = env_flag("VALVE_ACTIVE_LOW", os.getenv("RELAY_ACTIVE_LOW", "0"))
-    heater_active_low: bool = env_flag("HEATER_ACTIVE_LOW", os.getenv("RELAY_ACTIVE_LOW", "0"))
+    valve_active_low: bool = env_flag("VALVE_ACTIVE_LOW", env_str("RELAY_ACTIVE_LOW", "0"))
+    heater_active_low: bool = env_flag("HEATER_ACTIVE_LOW", env_str("RELAY_ACTIVE_LOW", "0"))
     lift_active_low: bool = env_flag("LIFT_ACTIVE_LOW", "1")
 
-    lift_speed_mm_s: float = max(0.1, float(os.getenv("LIFT_SPEED_MM_S", "10")))
-    lift_max_mm: float = max(1.0, float(os.getenv("LIFT_MAX_MM", "1000")))
+    lift_speed_mm_s: float = max(0.1, env_float("LIFT_SPEED_MM_S", "10"))
+    lift_max_mm: float = max(1.0, env_float("LIFT_MAX_MM", "1000"))
 
 
 class GPIOController:
     def __init__(self, config: Optional[GPIOConfig] = None) -> None:
         self.config = config or GPIOConfig()
         self.backend = self._detect_backend(self.config.backend)
+        self._device_factory = self._bind_device_factory()
+        self._batch_gpio = PIN_GPIO_MODULES.get(self.backend)
 
         self.pump1 = self._create_output_device(self.config.pin_pump1, self.config.relay_active_low)
         self.pump2 = self._create_output_device(self.config.pin_pump2, self.config.relay_active_low)
         self.pump3 = self._create_output_device(self.config.pin_pump3, self.config.relay_active_low)
-        for pump in (self.pump1, self.pump2, self.pump3):
-            pump.off()
+        # index/pin never change after startup; relay_snapshot() only refreshes "on". The view is shared,
+        # so only event-loop callers use it; snapshot() also runs on the persistence thread.
+        self._relay_devices = (self.pump1, self.pump2, self.pump3)
+        self._relay_view: List[Dict[str, object]] = [
+            {"index": index, "pin": pin, "on": False}
+            for index, pin in enumerate((self.config.pin_pump1, self.config.pin_pump2, self.config.pin_pump3))
+        ]
 
         self.valve_fresh = self._create_output_device(self.config.pin_valve_fresh, self.config.valve_active_low)
         self.valve_heat = self._create_output_device(self.config.pin_valve_heat, self.config.valve_active_low)
-        self.valve_fresh.off()
-        self.valve_heat.off()
+        self._valves = {"fresh": self.valve_fresh, "heat": self.valve_heat}
 
         self.lift_up = self._create_output_device(self.config.pin_lift_up, self.config.lift_active_low)
         self.lift_down = self._create_output_device(self.config.pin_lift_down, self.config.lift_active_low)
-        self.lift_up.off()
-        self.lift_down.off()
 
         self.heater = self._create_output_device(self.config.pin_heater, self.config.heater_active_low)
-        self.heater.off()
+
+        # Force every managed line off in one batched write rather than one call per device.
+        outputs = (*self._relay_devices, self.valve_fresh, self.valve_heat, self.lift_up, self.lift_down, self.heater)
+        self._write_outputs([(device, False) for device in outputs])
 
         self.auto_switches = {"fresh": False, "heat": False}
-        self.lift_state = "stop"
+        self.lift = LiftState.STOP
+        # Output writes per target state; the line being released is always written first.
+        self._lift_writes = (
+            [(self.lift_up, False), (self.lift_down, False)],
+            [(self.lift_down, False), (self.lift_up, True)],
+            [(self.lift_up, False), (self.lift_down, True)],
+        )
         self.lift_lock = threading.Lock()
-        self.lift_estimated_mm = 0.0
-        self.lift_last_update_ts = time.time()
+        # (state, monotonic ts, mm) at the last lift change. Writers replace the tuple under lift_lock;
+        # readers take one reference and integrate from it without locking.
+        # Monotonic so NTP steps of the wall clock can't stall or jump the position estimate.
+        self._lift_anchor: Tuple[LiftState, float, float] = (LiftState.STOP, time.monotonic(), 0.0)
+        # Config-derived snapshot fields, computed once instead of per snapshot.
+        self._lift_max_mm_view = int(self.config.lift_max_mm)
+        self._lift_speed_view = round(self.config.lift_speed_mm_s, 2)
 
     def _detect_backend(self, raw_backend: str) -> str:
         backend = raw_backend.lower()
@@ -229,54 +246,74 @@ class GPIOController:
             return "gpiozero"
         return "stub"
 
+    def _bind_device_factory(self) -> Callable[..., OutputDevice]:
+        gpio_module = PIN_GPIO_MODULES.get(self.backend)
+        if gpio_module is not None:
+            return functools.partial(PinOutputDevice, gpio_module=gpio_module, pin_mode=self.config.pin_mode)
+        return DEVICE_CLASSES[self.backend]
+
     def _create_output_device(self, pin: int, active_low: bool) -> OutputDevice:
-        if self.backend == "jetson":
-            return JetsonOutputDevice(pin, pin_mode=self.config.pin_mode, active_low=active_low, initial_value=False)
-        if self.backend == "rpigpio":
-            return RpiOutputDevice(pin, pin_mode=self.config.pin_mode, active_low=active_low, initial_value=False)
-        if self.backend == "gpiozero":
-            return GpiozeroOutputDevice(pin, active_low=active_low, initial_value=False)
-        return StubOutputDevice(pin, active_low=active_low, initial_value=False)
-
-    def _update_lift_estimate_locked(self, now_ts: Optional[float] = None) -> None:
-        now = now_ts if now_ts is not None else time.time()
-        elapsed = max(0.0, now - self.lift_last_update_ts)
-        if elapsed <= 0:
+        return self._device_factory(pin, active_low=active_low, initial_value=False)
+
+    def _write_outputs(self, writes: List[Tuple[OutputDevice, bool]]) -> None:
+        # Jetson.GPIO and RPi.GPIO accept channel/value lists, so drive all lines in one call.
+        gpio_module = self._batch_gpio
+        if gpio_module is None:
+            for device, on in writes:
+                if on:
+                    device.on()
+                else:
+                    device.off()
             return
-        if self.lift_state == "up":
-            self.lift_estimated_mm = min(self.config.lift_max_mm, self.lift_estimated_mm + self.config.lift_speed_mm_s * elapsed)
-        elif self.lift_state == "down":
-            self.lift_estimated_mm = max(0.0, self.lift_estimated_mm - self.config.lift_speed_mm_s * elapsed)
-        self.lift_last_update_ts = now
+        pins = [device.pin for device, _ in writes]
+        levels = [device.on_level if on else device.off_level for device, on in writes]
+        gpio_module.output(pins, levels)
+        for device, on in writes:
+            device.is_active = on
+
+    def _lift_position(self, anchor: Tuple[LiftState, float, float], now: float) -> float:
+        state, anchor_ts, anchor_mm = anchor
+        direction = LIFT_DIRECTIONS[state]
+        if not direction:
+            return anchor_mm
+        moved_mm = anchor_mm + direction * self.config.lift_speed_mm_s * max(0.0, now - anchor_ts)
+        return max(0.0, min(self.config.lift_max_mm, moved_mm))
+
+    @property
+    def lift_state(self) -> str:
+        return LIFT_STATE_NAMES[self.lift]
 
     def set_lift_estimated_mm(self, value_mm: float) -> None:
         with self.lift_lock:
-            self.lift_estimated_mm = max(0.0, min(self.config.lift_max_mm, float(value_mm)))
-            self.lift_last_update_ts = time.time()
+            mm = max(0.0, min(self.config.lift_max_mm, float(value_mm)))
+            self._lift_anchor = (self.lift, time.monotonic(), mm)
 
     def get_lift_estimate(self) -> tuple[float, int]:
-        with self.lift_lock:
-            self._update_lift_estimate_locked()
-            mm = float(self.lift_estimated_mm)
+        mm = self._lift_position(self._lift_anchor, time.monotonic())
         percent = int(round((mm / self.config.lift_max_mm) * 100))
         return mm, max(0, min(100, percent))
 
-    def relay_snapshot(self) -> List[Dict[str, object]]:
+    def relay_states(self) -> List[Dict[str, object]]:
         return [
-            {"index": 0, "pin": self.config.pin_pump1, "on": self.pump1.is_active},
-            {"index": 1, "pin": self.config.pin_pump2, "on": self.pump2.is_active},
-            {"index": 2, "pin": self.config.pin_pump3, "on": self.pump3.is_active},
+            {"index": index, "pin": device.pin, "on": device.is_active}
+            for index, device in enumerate(self._relay_devices)
         ]
 
-    def set_relay(self, index: int, on: bool) -> bool:
-        if index == 0:
-            target = self.pump1
-        elif index == 1:
-            target = self.pump2
-        elif index == 2:
-            target = self.pump3
-        else:
+    def relay_snapshot(self) -> List[Dict[str, object]]:
+        for item, device in zip(self._relay_view, self._relay_devices):
+            item["on"] = device.is_active
+        return self._relay_view
+
+    def relay_device(self, index: int) -> OutputDevice:
+        if index < 0:
             raise ValueError("Invalid relay index.")
+        try:
+            return self._relay_devices[index]
+        except IndexError:
+            raise ValueError("Invalid relay index.") from None
+
+    def set_relay(self, index: int, on: bool) -> bool:
+        target = self.relay_device(index)
         if on:
             target.on()
         else:
@@ -284,19 +321,17 @@ class GPIOController:
         return target.is_active
 
     def set_auto(self, which: str, on: bool) -> Dict[str, object]:
-        if which not in self.auto_switches:
+        valve = self._valves.get(which)
+        if valve is None:
             raise ValueError("Invalid auto switch.")
-        self.auto_switches[which] = bool(on)
-        if which == "fresh":
-            if on:
-                self.valve_fresh.on()
-            else:
-                self.valve_fresh.off()
-        else:
+        on = bool(on)
+        # Skip the GPIO write when the valve is already in the requested state.
+        if self.auto_switches[which] != on:
             if on:
-                self.valve_heat.on()
+                valve.on()
             else:
-                self.valve_heat.off()
+                valve.off()
+            self.auto_switches[which] = on
         return {
             "fresh": self.auto_switches["fresh"],
             "heat": self.auto_switches["heat"],
@@ -304,24 +339,16 @@ class GPIOController:
         }
 
     def set_lift(self, state: str) -> str:
-        if state not in {"up", "down", "stop"}:
+        target = LIFT_STATES.get(state)
+        if target is None:
             raise ValueError("Invalid lift state.")
         with self.lift_lock:
-            self._update_lift_estimate_locked()
-            if state == "up":
-                self.lift_down.off()
-                self.lift_up.on()
-                self.lift_state = "up"
-                return self.lift_state
-            if state == "down":
-                self.lift_up.off()
-                self.lift_down.on()
-                self.lift_state = "down"
-                return self.lift_state
-            self.lift_up.off()
-            self.lift_down.off()
-            self.lift_state = "stop"
-            return self.lift_state
+            now = time.monotonic()
+            mm = self._lift_position(self._lift_anchor, now)
+            self._write_outputs(self._lift_writes[target])
+            self.lift = target
+            self._lift_anchor = (target, now, mm)
+            return LIFT_STATE_NAMES[target]
 
     def set_heater(self, on: bool) -> bool:
         if on:
@@ -332,20 +359,21 @@ class GPIOController:
 
     def snapshot(self) -> Dict[str, object]:
         mm, percent = self.get_lift_estimate()
+        auto = self.auto_switches
         return {
-            "relays": self.relay_snapshot(),
+            "relays": self.relay_states(),
             "auto": {
-                "fresh": self.auto_switches["fresh"],
-                "heat": self.auto_switches["heat"],
+                "fresh": auto["fresh"],
+                "heat": auto["heat"],
                 "configured": True,
             },
             "lift": {
                 "configured": True,
-                "state": self.lift_state,
+                "state": LIFT_STATE_NAMES[self.lift],
                 "estimated_mm": round(mm, 1),
                 "estimated_percent": percent,
-                "max_mm": int(self.config.lift_max_mm),
-                "speed_mm_s": round(self.config.lift_speed_mm_s, 2),
+                "max_mm": self._lift_max_mm_view,
+                "speed_mm_s": self._lift_speed_view,
             },
             "heater": {
                 "configured": True,